@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# Benchmark of the new ticket detection of ggus_new_tickets.py on a ticket
+# store with a long history, against the ID list and per ticket SQL it
+# replaced.
+
+from __future__ import print_function
+
+import os
+import time
+import random
+import hashlib
+import argparse
+import sqlite3
+import tempfile
+import shutil
+import textwrap
+
+import ggus_store
+import ggus_new_tickets
+from ggus_new_tickets import GGUSTicket
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""\
+
+            Generate a ggus.db of the old format with the given number of
+            ticket IDs, and the same database upgraded to a ticket store.
+            Then detect the new tickets among a search result of the given
+            size, store them and render the mail, as ggus_new_tickets.py
+            did with an ID list and as it does now with the store.
+
+            Script output:
+            For each number of tickets: the time of each way and a hash of
+            the mail, which must be the same for both.
+            """))
+
+    parser.add_argument("--history",
+                        dest="history",
+                        type=int,
+                        default=100000,
+                        help="Number of ticket IDs in ggus.db (default: %(default)s)")
+
+    parser.add_argument("--tickets",
+                        dest="tickets",
+                        default="100,1000,5000",
+                        help=("Comma separated numbers of tickets in the search "
+                              "result (default: %(default)s)"))
+
+    parser.add_argument("--new",
+                        dest="new",
+                        type=float,
+                        default=0.05,
+                        help=("Fraction of the tickets that is not in the "
+                              "history (default: %(default)s)"))
+
+    parser.add_argument("--seed",
+                        dest="seed",
+                        type=int,
+                        default=1,
+                        help="Random seed (default: %(default)s)")
+
+    return parser.parse_args()
+
+
+def old(path, tickets, closed_tickets, support_unit):
+    """ggus_new_tickets.py as it was, on tuples of ggus_store.COLUMNS
+    instead of minidom tickets."""
+    conn=sqlite3.connect(path)
+    c=conn.cursor()
+    c.execute('''select id from tickets''')
+    result=c.fetchall()
+    ids=[]
+    for r in result:
+        ids.append(str(r[0]))
+
+    tickets = [GGUSTicket(fields, support_unit) for fields in tickets]
+
+    separator = "-" * 80
+    our_tickets = []
+    for ticket in tickets:
+        if ticket.status=='assigned':
+            if ticket.affected_site=='SARA-MATRIX':
+                our_tickets.append(ticket)
+                continue
+        else:
+            c.execute("delete from tickets where id==%s" % ticket.ticket_id)
+            conn.commit()
+
+    closed_tickets = [GGUSTicket(fields, support_unit) for fields in closed_tickets]
+    for ticket in closed_tickets:
+        c.execute("delete from tickets where id==%s" % ticket.ticket_id)
+        conn.commit()
+
+    new_tickets=[]
+
+    for ticket in our_tickets:
+        if ticket.ticket_id not in ids:
+            new_tickets.append(ticket)
+            c.execute("insert into tickets (id) values(%s)" % ticket.ticket_id)
+    if len(new_tickets)!=0:
+        conn.commit()
+    conn.close()
+
+    text=""
+    if len(new_tickets)!=0:
+        text=ggus_new_tickets.message_header % {"ticket count": len(new_tickets)}+'\n\n'+separator
+
+    su_tickets=[]
+    for ticket in new_tickets:
+        if not ticket.affected_site:
+            su_tickets.append(ticket)
+            continue
+
+        t=ticket.render()
+        text=text+'\n'+t+'\n'+separator
+
+    for ticket in su_tickets:
+        t=ticket.render()
+        text=text+'\n'+t+'\n'+separator
+
+    if len(new_tickets)!=0:
+        text=text+'\n'+separator
+
+    subject="GRID: New GGUS tickets:"
+    for ticket in new_tickets:
+        subject=subject+' '+str(ticket.ticket_id)
+
+    return subject + "\n" + text
+
+
+def new(path, tickets, support_unit):
+    store = ggus_store.TicketStore(path)
+    store.update(tickets)
+    new_tickets = [GGUSTicket(fields, support_unit)
+                   for fields in store.take_new("SARA-MATRIX")]
+    store.close()
+
+    text = ""
+    if new_tickets:
+        text = "\n".join(ggus_new_tickets.report(new_tickets))
+    subject = "GRID: New GGUS tickets: " + " ".join(str(ticket.ticket_id) for ticket in new_tickets)
+
+    return subject + "\n" + text
+
+
+def generate(count, history, fraction):
+    """Return the open and the closed tickets of a search, newest first,
+    as tuples of ggus_store.TAGS."""
+    tickets = []
+    for n in range(count):
+        if random.random() < fraction:
+            ticket_id = history + n + 1
+        else:
+            ticket_id = random.randint(1, history)
+        site = random.choice(("SARA-MATRIX", "SARA-MATRIX", "NIKHEF-ELPROD", ""))
+        status = random.choice(("assigned", "assigned", "in progress", "solved"))
+        tickets.append((str(ticket_id), site or None, "2018-05-28 12:00:00", status,
+                        "Jobs fail on CE %d" % n, "USER", "EGI", "vo%d" % (n % 7)))
+    # The same ticket only once, as in a search result.
+    tickets = dict((ticket[0], ticket) for ticket in tickets).values()
+    tickets.sort(key=lambda ticket: int(ticket[0]), reverse=True)
+    return ([ticket for ticket in tickets if ticket[3] != "solved"],
+            [ticket for ticket in tickets if ticket[3] == "solved"])
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="ggus-benchmark-")
+    try:
+        # The old database holds the IDs of the tickets mailed about.
+        old_db = os.path.join(workdir, "old.db")
+        conn = sqlite3.connect(old_db)
+        conn.execute("create table tickets (id int)")
+        conn.executemany("insert into tickets values (?)",
+                         [(n,) for n in range(1, args.history + 1)])
+        conn.commit()
+        conn.close()
+        store_db = os.path.join(workdir, "store.db")
+        shutil.copy(old_db, store_db)
+        ggus_store.TicketStore(store_db).close()
+
+        print("%-8s %7s %8s %9s %s" % ("way", "history", "tickets", "seconds", "mail"))
+        for count in [int(count) for count in args.tickets.split(",")]:
+            (open_tickets, closed_tickets) = generate(count, args.history, args.new)
+
+            path = os.path.join(workdir, "run.db")
+            shutil.copy(old_db, path)
+            start = time.time()
+            mail = old(path, open_tickets, closed_tickets, ggus_new_tickets.SUPPORT_UNIT)
+            elapsed = time.time() - start
+            print("%-8s %7d %8d %9.3f %s" % ("old", args.history, count, elapsed,
+                                             hashlib.sha256(mail.encode("utf-8")).hexdigest()[:12]))
+
+            shutil.copy(store_db, path)
+            start = time.time()
+            mail = new(path, open_tickets + closed_tickets, ggus_new_tickets.SUPPORT_UNIT)
+            elapsed = time.time() - start
+            print("%-8s %7d %8d %9.3f %s" % ("store", args.history, count, elapsed,
+                                             hashlib.sha256(mail.encode("utf-8")).hexdigest()[:12]))
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# Benchmark of ggus_client.parse_tickets and the GGUSTicket records of
+# gorilla.py against the minidom tickets they replaced, on generated
+# ticket searches of growing size.
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import shutil
+import subprocess
+import textwrap
+
+from xml.dom import minidom
+from xml.sax.saxutils import escape
+
+import ggus_client
+import gorilla
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""\
+
+            Generate GGUS ticket searches (as XML) with the given numbers
+            of tickets, and parse and render each of them in a separate
+            process, as gorilla.py did with minidom and as it does now.
+
+            Script output:
+            For each search and parser: the size of the XML, the time to
+            parse it and render all tickets, the peak memory use (RSS) of
+            the process, and a hash of the rendered tickets, which must be
+            the same for both parsers.
+            """))
+
+    parser.add_argument("--sizes",
+                        dest="sizes",
+                        default="1000,10000,50000",
+                        help=("Comma separated numbers of tickets "
+                              "(default: %(default)s)"))
+
+    parser.add_argument("--repeat",
+                        dest="repeat",
+                        type=int,
+                        default=3,
+                        help=("Number of times each search is parsed; the "
+                              "fastest time is reported (default: %(default)s)"))
+
+    parser.add_argument("--keep",
+                        dest="keep",
+                        default=False,
+                        action="store_true",
+                        help="Keep the generated searches.")
+
+    parser.add_argument("--parse",
+                        dest="parse",
+                        nargs=2,
+                        metavar=("PARSER", "FILE"),
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+class MinidomTicket(object):
+    """GGUSTicket of gorilla.py as it was, on a minidom node."""
+
+    support_unit_tag = gorilla.GGUSTicket.support_unit_tag
+    site_tag = gorilla.GGUSTicket.site_tag
+    body_template = gorilla.GGUSTicket.body_template
+    render = gorilla.GGUSTicket.__dict__["render"]
+
+    def __init__(self, ticket, support_unit):
+        self.ticket = ticket
+        self.support_unit = support_unit
+
+    def _get_by_xml_tag(self, tag):
+        aux = self.ticket.getElementsByTagName(tag)
+        if aux:
+            try:
+                return aux[0].firstChild.nodeValue
+            except: pass
+
+        return None
+
+    @property
+    def affected_site(self):
+        return self._get_by_xml_tag("Site")
+
+    @property
+    def last_update(self):
+        return self._get_by_xml_tag("Last_Update")
+
+    @property
+    def status(self):
+        return self._get_by_xml_tag("Status")
+
+    @property
+    def subject(self):
+        return self._get_by_xml_tag("Subject")
+
+    @property
+    def ticket_id(self):
+        return self._get_by_xml_tag("Ticket-ID")
+
+    @property
+    def ttype(self):
+        return self._get_by_xml_tag("Type")
+
+    @property
+    def scope(self):
+        return self._get_by_xml_tag("Scope")
+
+    @property
+    def vo(self):
+        return self._get_by_xml_tag("VO")
+
+
+def parse_minidom(content):
+    return [MinidomTicket(ticket, gorilla.SUPPORT_UNIT)
+            for ticket in minidom.parseString(content).getElementsByTagName("ticket")]
+
+
+def parse_stream(content):
+    return [gorilla.GGUSTicket(fields, gorilla.SUPPORT_UNIT)
+            for fields in ggus_client.parse_tickets(content, gorilla.GGUSTicket.tags)]
+
+
+def generate(path, count):
+    f = open(path, "w")
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tickets>\n')
+    for n in range(count):
+        # Every tenth ticket is for the support unit instead of a site.
+        site = "" if n % 10 == 0 else "<Site>SITE-%d</Site>" % (n % 25)
+        f.write("<ticket><Ticket-ID>%d</Ticket-ID>%s"
+                "<Last_Update>2018-05-%02d 12:00:00</Last_Update>"
+                "<Status>%s</Status><Subject>%s</Subject><Type>USER</Type>"
+                "<Scope>EGI</Scope><VO>vo%d</VO>"
+                "<Responsible_Unit>NGI_NL</Responsible_Unit><Priority>less urgent</Priority>"
+                "<Description>%s</Description></ticket>\n"
+                % (100000 + n, site, n % 28 + 1, ("assigned", "in progress", "solved")[n % 3],
+                   escape("Jobs fail on CE %d & SE" % n), n % 7,
+                   escape("Jobs fail with <error %d>. " % n) * 20))
+    f.write("</tickets>\n")
+    f.close()
+
+
+def run(args, name, path):
+    out = tempfile.TemporaryFile()
+    p = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--repeat",
+                          str(args.repeat), "--parse", name, path], stdout=out)
+    (_, status, usage) = os.wait4(p.pid, 0)
+    out.seek(0)
+    (elapsed, digest) = out.read().decode("ascii").split()
+    return (float(elapsed), usage.ru_maxrss / 1024.0, digest)
+
+
+def main():
+    args = parse_args()
+
+    if args.parse:
+        # In a child process, so that the peak RSS is that of one parser only.
+        (name, path) = args.parse
+        f = open(path, "rb")
+        content = f.read()
+        f.close()
+        parse = parse_minidom if name == "minidom" else parse_stream
+        best = None
+        for n in range(args.repeat):
+            start = time.time()
+            rendered = "\n".join(ticket.render() for ticket in parse(content))
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("%f %s" % (best, hashlib.sha256(rendered.encode("utf-8")).hexdigest()))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="ggus-benchmark-")
+    print("%-8s %9s %9s %9s %10s %s" % ("parser", "tickets", "MB", "seconds", "RSS (MB)", "result"))
+
+    try:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            path = os.path.join(workdir, "tickets%d.xml" % size)
+            generate(path, size)
+            megabytes = os.path.getsize(path) / 1048576.0
+            for name in ("minidom", "stream"):
+                (elapsed, rss, digest) = run(args, name, path)
+                print("%-8s %9d %9.1f %9.3f %10.1f %s" % (name, size, megabytes, elapsed, rss, digest[:12]))
+                sys.stdout.flush()
+    finally:
+        if args.keep:
+            print("Searches kept in %s" % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
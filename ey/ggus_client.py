@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# GGUS client shared by gorilla.py, ggus_report_generator.py and
+# ggus_new_tickets.py. Install it next to them (e.g. /usr/local/bin).
+#
+# The session cookie of a login is kept in a cookie jar on disk, so that
+# the scripts of one cron cycle log in once between them instead of once
+# per run. When GGUS does not answer a search with XML, the session has
+# probably expired: the client logs in again and repeats the search.
+
+from __future__ import print_function
+
+import io
+import os
+import datetime
+import threading
+import requests
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+try:
+    from cookielib import LWPCookieJar, LoadError
+except ImportError:
+    from http.cookiejar import LWPCookieJar, LoadError
+
+# Can be pointed at a test instance.
+GGUS_URL = os.environ.get("GGUS_URL", "https://ggus.eu")
+
+login_url = GGUS_URL + "/index.php?mode=login"
+
+search_url = (GGUS_URL + "/index.php?mode=ticket_search&ticket_id="
+              "&supportunit=%(support_unit)s&su_hierarchy=0&vo=all&user="
+              "&keyword=&involvedsupporter=&assignedto=&affectedsite=%(site)s"
+              "&specattrib=none&status=%(status)s&priority=&typeofproblem=all"
+              "&ticket_category=all&mouarea=&date_type=%(date_type)s"
+              "&tf_radio=%(tf_radio)s&timeframe=%(timeframe)s&from_date=%(from_date)s"
+              "&to_date=%(to_date)s&untouched_date="
+              "&orderticketsby=REQUEST_ID&orderhow=desc&search_submit=GO%%21"
+              "&writeFormat=XML")
+#https://ggus.eu/?mode=ticket_search&show_columns_check%5B%5D=TICKET_TYPE&show_columns_check%5B%5D=AFFECTED_VO&show_columns_check%5B%5D=AFFECTED_SITE&show_columns_check%5B%5D=PRIORITY&show_columns_check%5B%5D=RESPONSIBLE_UNIT&show_columns_check%5B%5D=STATUS&show_columns_check%5B%5D=DATE_OF_CHANGE&show_columns_check%5B%5D=SHORT_DESCRIPTION&show_columns_check%5B%5D=SCOPE&ticket_id=&supportunit=&su_hierarchy=0&former_su=&vo=&user=&keyword=&involvedsupporter=&assignedto=&affectedsite=SARA-MATRIX&specattrib=none&status=terminal&priority=&typeofproblem=all&ticket_category=all&mouarea=&date_type=closing+date&tf_radio=1&timeframe=lastmonth&from_date=28+May+2018&to_date=29+May+2018&untouched_date=&scope=&orderticketsby=REQUEST_ID&orderhow=desc&search_submit=GO%21
+
+COOKIES = os.environ.get("GGUS_COOKIES", os.path.expanduser("~/.ggus_cookies"))
+
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+          "Nov", "Dec")
+
+
+def search_date(date):
+    """A date as the search form wants it: 28+May+2018."""
+    return "%d+%s+%d" % (date.day, MONTHS[date.month - 1], date.year)
+
+
+class GGUSReportException(Exception):
+    pass
+
+
+class GGUSClient(object):
+    """A logged in GGUS session. One client can be used by several
+    threads; they share its connections and its login."""
+
+    def __init__(self, user, password, cookies=COOKIES):
+        self.user = user
+        self.password = password
+        self.cookies = cookies
+        self.lock = threading.Lock()
+        self.logins = 0
+
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.cookies = LWPCookieJar(cookies) if cookies else LWPCookieJar()
+        if cookies:
+            try:
+                # The GGUS cookie is a session cookie, which would be
+                # discarded otherwise.
+                self.session.cookies.load(ignore_discard=True)
+            except (IOError, LoadError):
+                pass
+
+    def save(self):
+        if not self.cookies:
+            return
+        # Write and rename, so that a script that runs at the same time
+        # never reads half a jar. Only we may read the session cookie.
+        tmp = "%s.%d.tmp" % (self.cookies, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.close(fd)
+        self.session.cookies.save(tmp, ignore_discard=True)
+        os.rename(tmp, self.cookies)
+
+    def login(self, stale=None):
+        """Log in, unless another thread already did so since the login
+        with the stale count of logins expired."""
+        with self.lock:
+            if stale is not None and self.logins != stale:
+                return
+            self.session.cookies.clear()
+            data = {"login": self.user, "password": self.password}
+            self.session.post(login_url, data=data)
+            if not self.session.cookies:
+                raise GGUSReportException("Could not authenticate with GGUS")
+            self.logins += 1
+            self.save()
+
+    def _is_xml(self, r):
+        if r.status_code != 200:
+            return False
+        if "xml" in r.headers.get("Content-Type", ""):
+            return True
+        return r.content.lstrip()[:5] == b"<?xml"
+
+    def get_xml(self, url):
+        """GET url, which should answer with XML, logging in first or
+        again when needed. Returns the body."""
+        if not self.session.cookies:
+            self.login()
+        logins = self.logins
+        r = self.session.get(url)
+        if not self._is_xml(r):
+            self.login(stale=logins)
+            r = self.session.get(url)
+        return r.content
+
+    def search(self, support_unit, site="", status="open", timeframe="any",
+               since=None):
+        """Return the XML of a ticket search. With since (a date), the
+        search is for the tickets that changed on or after that day,
+        instead of those created in the timeframe."""
+        query = {"support_unit": support_unit,
+                 "site": site,
+                 "status": status,
+                 "timeframe": timeframe,
+                 "date_type": "creation+date",
+                 "tf_radio": 1,
+                 "from_date": "",
+                 "to_date": ""}
+        if since is not None:
+            query.update({"date_type": "date+of+change",
+                          "tf_radio": 2,
+                          "from_date": search_date(since),
+                          "to_date": search_date(datetime.date.today() +
+                                                 datetime.timedelta(days=1))})
+        return self.get_xml(search_url % query)
+
+    def tickets(self, tags, support_unit, site="", status="open", timeframe="any",
+                since=None):
+        """Return, for each ticket of a ticket search, a tuple with the
+        text of the given tags of the ticket."""
+        return parse_tickets(self.search(support_unit, site, status, timeframe, since), tags)
+
+
+def parse_tickets(content, tags):
+    """Return, for each ticket element in content, a tuple with the text
+    of the first element of each of the tags in it (None if there is
+    none or it is empty).
+
+    The XML is parsed as a stream and every ticket is dropped once its
+    fields are taken, so that large searches do not build a whole
+    document tree."""
+    index = dict((tag, n) for (n, tag) in enumerate(tags))
+    tickets = []
+    # The open elements; the last one is the parent of an ending element.
+    parents = []
+    fields = None
+    try:
+        for (event, elem) in iterparse(io.BytesIO(content), events=("start", "end")):
+            if event == "start":
+                parents.append(elem)
+                if elem.tag == "ticket" and fields is None:
+                    fields = [None] * len(tags)
+                    found = set()
+                continue
+            parents.pop()
+            if fields is None:
+                continue
+            if elem.tag == "ticket":
+                tickets.append(tuple(fields))
+                fields = None
+                # The tickets need not be children of the root element.
+                if parents:
+                    parents[-1].clear()
+            elif elem.tag in index and elem.tag not in found:
+                fields[index[elem.tag]] = elem.text or None
+                found.add(elem.tag)
+    except SyntaxError:
+        raise GGUSReportException("Could not parse XML content")
+
+    return tickets
@@ -7,9 +7,6 @@
 from __future__ import print_function
 
 import argparse
-import requests
-import xml.parsers.expat
-import sqlite3
 import re
 
 import smtplib, os
@@ -19,7 +16,8 @@ from email.MIMEText import MIMEText
 from email.Utils import COMMASPACE, formatdate
 from email import Encoders
 
-from xml.dom import minidom
+import ggus_client
+import ggus_store
 
 __version__ = 20141002
 
@@ -66,9 +64,6 @@ def send_mail(send_from, send_to, subject, text, files=[], server="localhost"):
     smtp.sendmail(send_from, send_to, msg.as_string())
     smtp.close()
 
-class GGUSReportException(Exception):
-    pass
-
 class GGUSTicket(object):
     support_unit_tag = "SUPPORT UNIT"
     site_tag = "SITE"
@@ -83,50 +78,14 @@ class GGUSTicket(object):
       VO          : %(vo)s
       Link        : https://ggus.eu/ws/ticket_info.php?ticket=%(ticket_id)s"""
 
-    def __init__(self, ticket, support_unit):
-        self.ticket = ticket
-        self.support_unit = support_unit
-
-    def _get_by_xml_tag(self, tag):
-        aux = self.ticket.getElementsByTagName(tag)
-        if aux:
-            try:
-                return aux[0].firstChild.nodeValue
-            except: pass
-
-        return None
-
-    @property
-    def affected_site(self):
-        return self._get_by_xml_tag("Site")
-
-    @property
-    def last_update(self):
-        return self._get_by_xml_tag("Last_Update")
-
-    @property
-    def status(self):
-        return self._get_by_xml_tag("Status")
-
-    @property
-    def subject(self):
-        return self._get_by_xml_tag("Subject")
-
-    @property
-    def ticket_id(self):
-        return self._get_by_xml_tag("Ticket-ID")
-
-    @property
-    def ttype(self):
-        return self._get_by_xml_tag("Type")
-
-    @property
-    def scope(self):
-        return self._get_by_xml_tag("Scope")
+    __slots__ = ("ticket_id", "affected_site", "last_update", "status",
+                 "subject", "ttype", "scope", "vo", "support_unit")
 
-    @property
-    def vo(self):
-        return self._get_by_xml_tag("VO")
+    def __init__(self, fields, support_unit):
+        """fields are those of ggus_store.COLUMNS."""
+        (self.ticket_id, self.affected_site, self.last_update, self.status,
+         self.subject, self.ttype, self.scope, self.vo) = fields
+        self.support_unit = support_unit
 
     def render(self):
         d = {
@@ -151,52 +110,25 @@ class GGUSTicket(object):
 
 
 
-class GGUSConnection(object):
-    url = ("https://ggus.eu/index.php?mode=ticket_search&ticket_id="
-           "&supportunit=%(support_unit)s&su_hierarchy=0&vo=all&user="
-           "&keyword=&involvedsupporter=&assignedto=&affectedsite="
-           "&specattrib=none&status=%(status)s&priority=&typeofproblem=all"
-           "&ticket_category=all&mouarea=&date_type=creation+date"
-           "&tf_radio=1&timeframe=lastmonth&from_date=&to_date=&untouched_date="
-           "&orderticketsby=REQUEST_ID&orderhow=desc&search_submit=GO%%21"
-           "&writeFormat=XML")
-
-    def __init__(self, user, password, support_unit, status='open'):
-        self.session = None
-        self.user = user
-        self.password = password
-        self.support_unit = support_unit
-        self.status = status
-        self.url = self.url % {"support_unit": support_unit,"status": status}
-
-    def _get_ggus_session(self):
-        s = requests.Session()
-        s.verify = False
-        data = {"login": self.user, "password": self.password}
-        url = "https://ggus.eu/index.php?mode=login"
-        s.post(url, data=data)
-
-        self.session = s
-
-    def login(self):
-        self._get_ggus_session()
-        if not self.session.cookies:
-            raise GGUSReportException("Could not authenticate with GGUS")
-
-    def tickets(self):
-        if not self.session:
-            self.login()
-
-        r = self.session.get(self.url)
+def report(tickets):
+    """Yield the lines of the mail about the tickets."""
+    separator = "-" * 80
+    yield message_header % {"ticket count": len(tickets)} + "\n"
+    yield separator
 
-        try:
-            aux = minidom.parseString(r.content)
-        except xml.parsers.expat.ExpatError:
-            raise GGUSReportException("Could not parse XML content")
+    su_tickets = []
+    for ticket in tickets:
+        if not ticket.affected_site:
+            su_tickets.append(ticket)
+            continue
+        yield ticket.render()
+        yield separator
 
-        tickets = aux.getElementsByTagName('ticket')
+    for ticket in su_tickets:
+        yield ticket.render()
+        yield separator
 
-        return [GGUSTicket(ticket, self.support_unit) for ticket in tickets]
+    yield separator
 
 
 def parse_args():
@@ -225,88 +157,50 @@ def parse_args():
                         action='store_true',
                         help='Sort tickets in reverse chronological order.')
 
+    parser.add_argument('-c', '--cookies',
+                        dest='cookies',
+                        metavar='FILE',
+                        default=ggus_client.COOKIES,
+                        help=('File to keep the GGUS login session in, '
+                              'shared with the other GGUS scripts '
+                              '(default: %(default)s)'))
+
+    parser.add_argument('-d', '--db',
+                        dest='db',
+                        metavar='FILE',
+                        default='ggus.db',
+                        help='Local ticket store (default: %(default)s)')
+
+    parser.add_argument('-f', '--full',
+                        dest='full',
+                        default=False,
+                        action='store_true',
+                        help=('Fetch all open tickets and the tickets closed '
+                              'last month, instead of only the tickets that '
+                              'changed since the last run.'))
+
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    conn=sqlite3.connect('ggus.db')
-    c=conn.cursor()
-    c.execute('''select id from tickets''')
-    result=c.fetchall()
-    ids=[]
-    for r in result:
-        ids.append(str(r[0]))
+    store = ggus_store.TicketStore(args.db)
+    ggus = ggus_client.GGUSClient(args.username, args.password, args.cookies)
 
-    ggus = GGUSConnection(args.username,
-                          args.password,
-                          args.support_unit)
+    # Only the tickets that changed since the last run are fetched.
+    ggus_store.sync(ggus, store, args.support_unit, args.full)
 
-    tickets = ggus.tickets()
+    new_tickets = [GGUSTicket(fields, args.support_unit)
+                   for fields in store.take_new('SARA-MATRIX')]
+    store.close()
 
     if args.reverse:
-        tickets.reverse()
-
-
-    separator = "-" * 80
-    our_tickets = []
-    for ticket in tickets:
-        if ticket.status=='assigned':
-#            if not ticket.affected_site:
-#                our_tickets.append(ticket)
-#                continue
-            if ticket.affected_site=='SARA-MATRIX':
-                our_tickets.append(ticket)
-                continue
-        else:
-            c.execute("delete from tickets where id==%s" % ticket.ticket_id)
-            conn.commit()
-
-    ggus = GGUSConnection(args.username,
-                          args.password,
-                          args.support_unit,
-                          'terminal')
-
-    closed_tickets = ggus.tickets()
-    for ticket in closed_tickets:
-        c.execute("delete from tickets where id==%s" % ticket.ticket_id)
-        conn.commit()
-
-
-    new_tickets=[]
-    
-    for ticket in our_tickets:
-        if ticket.ticket_id not in ids:
-            new_tickets.append(ticket)
-            c.execute("insert into tickets (id) values(%s)" % ticket.ticket_id)
-    if len(new_tickets)!=0:
-        conn.commit()
-    conn.close()
-
-
-    if len(new_tickets)!=0:
-        text=message_header % {"ticket count": len(new_tickets)}+'\n\n'+separator
-
-    su_tickets=[]
-    for ticket in new_tickets:
-        if not ticket.affected_site:
-            su_tickets.append(ticket)
-            continue
-      
-        t=ticket.render()
-        text=text+'\n'+t+'\n'+separator
-      
-
-    for ticket in su_tickets:
-        t=ticket.render()
-        text=text+'\n'+t+'\n'+separator
+        new_tickets.reverse()
 
     if len(new_tickets)!=0:
-        text=text+'\n'+separator
+        text="\n".join(report(new_tickets))
 
-    subject="GRID: New GGUS tickets:"
-    for ticket in new_tickets:
-        subject=subject+' '+str(ticket.ticket_id)
+    subject="GRID: New GGUS tickets: "+" ".join(str(ticket.ticket_id) for ticket in new_tickets)
 
     if len(new_tickets)!=0:
 #        send_mail('ey@surfsara.nl',['helpdesk@surfsara.nl','grid-adm@surfsara.nl'],subject,text)
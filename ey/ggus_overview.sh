@@ -12,16 +12,14 @@ address=""
 
 tmpfile=`mktemp`
 
-/usr/local/bin/gorilla.py username password -l SARA-MATRIX open 1>${tmpfile} 2>/dev/null
-echo >>${tmpfile}
-/usr/local/bin/gorilla.py username password -l NIKHEF-ELPROD open 1>>${tmpfile} 2>/dev/null
+sites=SARA-MATRIX,NIKHEF-ELPROD
+
+/usr/local/bin/gorilla.py username password -l ${sites} open 1>${tmpfile} 2>/dev/null
 echo >>${tmpfile}
 
 /usr/bin/mutt -s "Open GGUS tickets overview "$datestring $address <${tmpfile}
 username
-/usr/local/bin/gorilla.py username password -l SARA-MATRIX terminal 1>${tmpfile} 2>/dev/null
-echo >>${tmpfile}
-/usr/local/bin/gorilla.py username password -l NIKHEF-ELPROD terminal 1>>${tmpfile} 2>/dev/null
+/usr/local/bin/gorilla.py username password -l ${sites} terminal 1>${tmpfile} 2>/dev/null
 echo >>${tmpfile}
 
 /usr/bin/mutt -s "Overview GGUS tickets that were closed in ""$monthstring" $address <${tmpfile}
@@ -8,10 +8,8 @@
 from __future__ import print_function
 
 import argparse
-import requests
-import xml.parsers.expat
 
-from xml.dom import minidom
+import ggus_client
 
 __version__ = 20141002
 
@@ -36,10 +34,6 @@ message_header = """
 There are %(ticket count)s open tickets under %(support_unit)s %(affected_siter)s scope.
 """
 
-class GGUSReportException(Exception):
-    pass
-
-
 class GGUSTicket(object):
     support_unit_tag = "SUPPORT UNIT"
     site_tag = "SITE"
@@ -51,39 +45,17 @@ class GGUSTicket(object):
       Description : %(subject)s
       Link        : https://ggus.eu/ws/ticket_info.php?ticket=%(request_id)s"""
 
-    def __init__(self, ticket, support_unit, affected_siter=""):
-        self.ticket = ticket
-        self.support_unit = support_unit
-        self.affected_siter = affected_siter
-
-    def _get_by_xml_tag(self, tag):
-        aux = self.ticket.getElementsByTagName(tag)
-        if aux:
-            try:
-                return aux[0].firstChild.nodeValue
-            except: pass
-
-        return None
+    # The XML tags of the fields, in the order of __slots__.
+    tags = ("affected_site", "date_of_creation", "status", "subject",
+            "request_id")
 
-    @property
-    def affected_site(self):
-        return self._get_by_xml_tag("affected_site")
+    __slots__ = tags + ("support_unit", "affected_siter")
 
-    @property
-    def date_of_creation(self):
-        return self._get_by_xml_tag("date_of_creation")
-
-    @property
-    def status(self):
-        return self._get_by_xml_tag("status")
-
-    @property
-    def subject(self):
-        return self._get_by_xml_tag("subject")
-
-    @property
-    def request_id(self):
-        return self._get_by_xml_tag("request_id")
+    def __init__(self, fields, support_unit, affected_siter=""):
+        (self.affected_site, self.date_of_creation, self.status,
+         self.subject, self.request_id) = fields
+        self.support_unit = support_unit
+        self.affected_siter = affected_siter
 
     def render(self):
         d = {
@@ -103,54 +75,6 @@ class GGUSTicket(object):
         return self.body_template % d
 
 
-class GGUSConnection(object):
-    url = ("https://ggus.eu/index.php?mode=ticket_search&ticket_id="
-           "&supportunit=%(support_unit)s&su_hierarchy=0&vo=all&user="
-           "&keyword=&involvedsupporter=&assignedto=&affectedsite=%(affected_siter)s"
-           "&specattrib=none&status=open&priority=&typeofproblem=all"
-           "&ticket_category=all&mouarea=&date_type=creation+date"
-           "&tf_radio=1&timeframe=any&from_date=&to_date=&untouched_date="
-           "&orderticketsby=REQUEST_ID&orderhow=desc&search_submit=GO%%21"
-           "&writeFormat=XML")
-
-    def __init__(self, user, password, support_unit, affected_siter):
-        self.session = None
-        self.user = user
-        self.password = password
-        self.support_unit = support_unit
-        self.affected_siter = affected_siter
-        self.url = self.url % {"support_unit": support_unit,"affected_siter":affected_siter}
-
-    def _get_ggus_session(self):
-        s = requests.Session()
-        s.verify = False
-        data = {"login": self.user, "password": self.password}
-        url = "https://ggus.eu/index.php?mode=login"
-        s.post(url, data=data)
-
-        self.session = s
-
-    def login(self):
-        self._get_ggus_session()
-        if not self.session.cookies:
-            raise GGUSReportException("Could not authenticate with GGUS")
-
-    def tickets(self):
-        if not self.session:
-            self.login()
-
-        r = self.session.get(self.url)
-
-        try:
-            aux = minidom.parseString(r.content)
-        except xml.parsers.expat.ExpatError:
-            raise GGUSReportException("Could not parse XML content")
-
-        tickets = aux.getElementsByTagName('ticket')
-
-        return [GGUSTicket(ticket, self.support_unit) for ticket in tickets]
-
-
 def parse_args():
     global SUPPORT_UNIT
     parser = argparse.ArgumentParser(description='TBD.')
@@ -184,18 +108,25 @@ def parse_args():
                         action='store_true',
                         help='Sort tickets in reverse chronological order.')
 
+    parser.add_argument('-c', '--cookies',
+                        dest='cookies',
+                        metavar='FILE',
+                        default=ggus_client.COOKIES,
+                        help=('File to keep the GGUS login session in, '
+                              'shared with the other GGUS scripts '
+                              '(default: %(default)s)'))
+
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
 
-    ggus = GGUSConnection(args.username,
-                          args.password,
-                          args.support_unit,
-                          args.affected_siter)
+    ggus = ggus_client.GGUSClient(args.username, args.password, args.cookies)
 
-    tickets = ggus.tickets()
+    tickets = [GGUSTicket(fields, args.support_unit)
+               for fields in ggus.tickets(GGUSTicket.tags, args.support_unit,
+                                          args.affected_siter)]
 
     if args.reverse:
         tickets.reverse()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# Local store of GGUS tickets (an sqlite database), kept up to date by
+# sync(): after a first full search, each run only fetches the tickets
+# that changed since the previous sync.
+#
+# The database of ggus_new_tickets.py used to hold only the IDs of the
+# tickets it had mailed about; such a database is upgraded in place, and
+# those tickets are marked as notified.
+
+from __future__ import print_function
+
+import datetime
+import sqlite3
+
+# The XML tags of a ticket and the columns they are stored in.
+TAGS = ("Ticket-ID", "Site", "Last_Update", "Status", "Subject", "Type",
+        "Scope", "VO")
+COLUMNS = ("id", "site", "last_update", "status", "subject", "ttype",
+           "scope", "vo")
+
+# Keep the number of SQL variables in one statement below the limit of
+# older sqlite versions.
+CHUNK = 500
+
+
+class TicketStore(object):
+
+    def __init__(self, path="ggus.db"):
+        self.conn = sqlite3.connect(path)
+        self.create()
+
+    def create(self):
+        c = self.conn.cursor()
+        with self.conn:
+            columns = [row[1] for row in c.execute("pragma table_info(tickets)")]
+            if not columns:
+                c.execute("create table tickets (id integer)")
+            for column in COLUMNS[1:]:
+                if column not in columns:
+                    c.execute("alter table tickets add column %s text" % column)
+            if "notified" not in columns:
+                c.execute("alter table tickets add column notified integer default 0")
+                # The tickets of an old database are the ones it mailed about.
+                c.execute("update tickets set notified=1")
+            if columns:
+                c.execute("delete from tickets where rowid not in "
+                          "(select min(rowid) from tickets group by id)")
+            c.execute("create unique index if not exists tickets_id on tickets (id)")
+            # For take_new(), which only touches the tickets it changes.
+            c.execute("create index if not exists tickets_new on tickets (status, site, notified)")
+            c.execute("create index if not exists tickets_notified on tickets (notified, status)")
+            c.execute("create table if not exists history "
+                      "(id integer, status text, last_update text, recorded text)")
+            c.execute("create index if not exists history_id on history (id)")
+            c.execute("create table if not exists sync (name text primary key, value text)")
+
+    def watermark(self):
+        """The day of the last sync, or None if there was none."""
+        row = self.conn.execute("select value from sync where name='watermark'").fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.strptime(row[0], "%Y-%m-%d").date()
+
+    def get(self, ids):
+        """Return the stored tickets with the given IDs, by ID."""
+        tickets = {}
+        ids = list(ids)
+        for n in range(0, len(ids), CHUNK):
+            chunk = ids[n:n + CHUNK]
+            rows = self.conn.execute("select %s, notified from tickets where id in (%s)"
+                                     % (", ".join(COLUMNS), ", ".join("?" * len(chunk))),
+                                     chunk)
+            for row in rows:
+                tickets[row[0]] = row
+        return tickets
+
+    def update(self, tickets, watermark=None):
+        """Store tickets (tuples of the TAGS), in one transaction, and
+        return the ones that are new or changed. A change of the status or
+        last update is recorded in the history of the ticket."""
+        latest = {}
+        for ticket in tickets:
+            try:
+                ticket_id = int(ticket[0])
+            except (TypeError, ValueError):
+                continue
+            latest[ticket_id] = (ticket_id,) + tuple(ticket[1:])
+
+        stored = self.get(latest)
+        now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        changed = [ticket for (ticket_id, ticket) in sorted(latest.items())
+                   if ticket_id not in stored or
+                   tuple(stored[ticket_id][:len(COLUMNS)]) != ticket]
+        history = [(ticket[0], ticket[3], ticket[2], now) for ticket in changed
+                   if ticket[0] not in stored or
+                   (stored[ticket[0]][3], stored[ticket[0]][2]) != (ticket[3], ticket[2])]
+
+        with self.conn:
+            self.conn.executemany("insert or ignore into tickets (id) values (?)",
+                                  [(ticket[0],) for ticket in changed])
+            self.conn.executemany("update tickets set %s where id=?"
+                                  % ", ".join("%s=?" % column for column in COLUMNS[1:]),
+                                  [ticket[1:] + ticket[:1] for ticket in changed])
+            self.conn.executemany("insert into history values (?, ?, ?, ?)", history)
+            if watermark is not None:
+                self.conn.execute("insert or replace into sync values ('watermark', ?)",
+                                  (watermark.strftime("%Y-%m-%d"),))
+
+        return changed
+
+    def take_new(self, site, status="assigned"):
+        """Return the tickets of the site with the status that were not
+        returned before, newest first, and mark them as notified. Tickets
+        that no longer have the status are marked as not notified again,
+        so that they are new again if they ever get it back."""
+        with self.conn:
+            tickets = self.conn.execute("select %s from tickets "
+                                        "where status=? and site=? and notified=0 "
+                                        "order by id desc" % ", ".join(COLUMNS),
+                                        (status, site)).fetchall()
+            self.conn.executemany("update tickets set notified=1 where id=?",
+                                  [(ticket[0],) for ticket in tickets])
+            # Not status!=?, with which sqlite would go through all notified
+            # tickets instead of only the ones to change.
+            for condition in ("status<?", "status>?"):
+                self.conn.execute("update tickets set notified=0 where notified=1 and %s"
+                                  % condition, (status,))
+        return tickets
+
+    def close(self):
+        self.conn.close()
+
+
+def sync(ggus, store, support_unit, full=False):
+    """Fetch the tickets of the support unit that changed since the last
+    sync (or, the first time or with full, the open tickets and those
+    closed last month) into the store. Returns the changed tickets."""
+    # GGUS searches by day; the day of the sync is searched again next time.
+    today = datetime.datetime.utcnow().date()
+    since = None if full else store.watermark()
+
+    tickets = []
+    if since is None:
+        tickets += ggus.tickets(TAGS, support_unit, status="open", timeframe="lastmonth")
+        tickets += ggus.tickets(TAGS, support_unit, status="terminal", timeframe="lastmonth")
+    else:
+        tickets += ggus.tickets(TAGS, support_unit, status="open", since=since)
+        tickets += ggus.tickets(TAGS, support_unit, status="terminal", since=since)
+
+    return store.update(tickets, today)
@@ -6,11 +6,11 @@
 
 from __future__ import print_function
 
+import sys
 import argparse
-import requests
-import xml.parsers.expat
+from multiprocessing.pool import ThreadPool
 
-from xml.dom import minidom
+import ggus_client
 
 __version__ = 20141002
 
@@ -35,10 +35,6 @@ message_header = """
 There are %(ticket count)s tickets %(text)s for %(site)s.
 """
 
-class GGUSReportException(Exception):
-    pass
-
-
 class GGUSTicket(object):
     support_unit_tag = "SUPPORT UNIT"
     site_tag = "SITE"
@@ -53,50 +49,17 @@ class GGUSTicket(object):
       VO          : %(vo)s
       Link        : https://ggus.eu/ws/ticket_info.php?ticket=%(ticket_id)s"""
 
-    def __init__(self, ticket, support_unit):
-        self.ticket = ticket
-        self.support_unit = support_unit
-
-    def _get_by_xml_tag(self, tag):
-        aux = self.ticket.getElementsByTagName(tag)
-        if aux:
-            try:
-                return aux[0].firstChild.nodeValue
-            except: pass
-
-        return None
-
-    @property
-    def affected_site(self):
-        return self._get_by_xml_tag("Site")
-
-    @property
-    def last_update(self):
-        return self._get_by_xml_tag("Last_Update")
+    # The XML tags of the fields, in the order of __slots__.
+    tags = ("Site", "Last_Update", "Status", "Subject", "Ticket-ID", "Type",
+            "Scope", "VO")
 
-    @property
-    def status(self):
-        return self._get_by_xml_tag("Status")
+    __slots__ = ("affected_site", "last_update", "status", "subject",
+                 "ticket_id", "ttype", "scope", "vo", "support_unit")
 
-    @property
-    def subject(self):
-        return self._get_by_xml_tag("Subject")
-
-    @property
-    def ticket_id(self):
-        return self._get_by_xml_tag("Ticket-ID")
-
-    @property
-    def ttype(self):
-        return self._get_by_xml_tag("Type")
-
-    @property
-    def scope(self):
-        return self._get_by_xml_tag("Scope")
-
-    @property
-    def vo(self):
-        return self._get_by_xml_tag("VO")
+    def __init__(self, fields, support_unit):
+        (self.affected_site, self.last_update, self.status, self.subject,
+         self.ticket_id, self.ttype, self.scope, self.vo) = fields
+        self.support_unit = support_unit
 
     def render(self):
         d = {
@@ -119,60 +82,6 @@ class GGUSTicket(object):
         return self.body_template % d
 
 
-class GGUSConnection(object):
-    url = ("https://ggus.eu/index.php?mode=ticket_search&ticket_id="
-           "&supportunit=%(support_unit)s&su_hierarchy=0&vo=all&user="
-           "&keyword=&involvedsupporter=&assignedto=&affectedsite=%(site)s"
-           "&specattrib=none&status=%(status)s&priority=&typeofproblem=all"
-           "&ticket_category=all&mouarea=&date_type=creation+date"
-           "&tf_radio=1&timeframe=%(timeframe)s&from_date=&to_date=&untouched_date="
-           "&orderticketsby=REQUEST_ID&orderhow=desc&search_submit=GO%%21"
-           "&writeFormat=XML")
-#https://ggus.eu/?mode=ticket_search&show_columns_check%5B%5D=TICKET_TYPE&show_columns_check%5B%5D=AFFECTED_VO&show_columns_check%5B%5D=AFFECTED_SITE&show_columns_check%5B%5D=PRIORITY&show_columns_check%5B%5D=RESPONSIBLE_UNIT&show_columns_check%5B%5D=STATUS&show_columns_check%5B%5D=DATE_OF_CHANGE&show_columns_check%5B%5D=SHORT_DESCRIPTION&show_columns_check%5B%5D=SCOPE&ticket_id=&supportunit=&su_hierarchy=0&former_su=&vo=&user=&keyword=&involvedsupporter=&assignedto=&affectedsite=SARA-MATRIX&specattrib=none&status=terminal&priority=&typeofproblem=all&ticket_category=all&mouarea=&date_type=closing+date&tf_radio=1&timeframe=lastmonth&from_date=28+May+2018&to_date=29+May+2018&untouched_date=&scope=&orderticketsby=REQUEST_ID&orderhow=desc&search_submit=GO%21
-
-    def __init__(self, user, password, support_unit, site, status):
-        self.session = None
-        self.user = user
-        self.password = password
-        self.support_unit = support_unit
-
-        if status=='open':
-            timeframe='any'
-        else:
-            timeframe='lastmonth'
-
-        self.url = self.url % {"support_unit": support_unit, "site": site, "status": status, "timeframe": timeframe}
-
-    def _get_ggus_session(self):
-        s = requests.Session()
-        s.verify = False
-        data = {"login": self.user, "password": self.password}
-        url = "https://ggus.eu/index.php?mode=login"
-        s.post(url, data=data)
-
-        self.session = s
-
-    def login(self):
-        self._get_ggus_session()
-        if not self.session.cookies:
-            raise GGUSReportException("Could not authenticate with GGUS")
-
-    def tickets(self):
-        if not self.session:
-            self.login()
-
-        r = self.session.get(self.url)
-
-        try:
-            aux = minidom.parseString(r.content)
-        except xml.parsers.expat.ExpatError:
-            raise GGUSReportException("Could not parse XML content")
-
-        tickets = aux.getElementsByTagName('ticket')
-
-        return [GGUSTicket(ticket, self.support_unit) for ticket in tickets]
-
-
 def parse_args():
     global SUPPORT_UNIT
     global SITE
@@ -190,7 +99,8 @@ def parse_args():
     parser.add_argument('status',
                         metavar='STATUS',
                         type=str,
-                        help='State of tickets.')
+                        help=('State of tickets: open or terminal, or a comma '
+                              'separated list of them.'))
 
     parser.add_argument('-s', '--support-unit',
                         dest='support_unit',
@@ -204,7 +114,8 @@ def parse_args():
                         metavar='SITE',
                         default=SITE,
                         help=('Only tickets belonging to this site '
-                              'will be collected'))
+                              'will be collected. A comma separated list '
+                              'of sites gives one report for each of them.'))
 
     parser.add_argument('-r', '--reverse',
                         dest='reverse',
@@ -212,32 +123,35 @@ def parse_args():
                         action='store_true',
                         help='Sort tickets in reverse chronological order.')
 
-    return parser.parse_args()
+    parser.add_argument('-c', '--cookies',
+                        dest='cookies',
+                        metavar='FILE',
+                        default=ggus_client.COOKIES,
+                        help=('File to keep the GGUS login session in, '
+                              'shared with the other GGUS scripts '
+                              '(default: %(default)s)'))
+
+    parser.add_argument('-w', '--workers',
+                        dest='workers',
+                        type=int,
+                        default=8,
+                        help=('Number of searches to run at the same time '
+                              '(default: %(default)s)'))
 
+    return parser.parse_args()
 
-def main():
-    args = parse_args()
-
-    if args.status!='open':
-        args.status='terminal'
-
-    ggus = GGUSConnection(args.username,
-                          args.password,
-                          args.support_unit,
-                          args.site,
-                          args.status)
-
-    tickets = ggus.tickets()
 
-    if args.reverse:
+def report(site, status, tickets, reverse=False):
+    """Print the report of one site and status."""
+    if reverse:
         tickets.reverse()
 
-    if args.status=='open':
+    if status=='open':
         text='still open'
     else:
         text='set to closed last month'
 
-    print (message_header % {"site_title": args.site, "ticket count": len(tickets), "text": text, "site": args.site})
+    print (message_header % {"site_title": site, "ticket count": len(tickets), "text": text, "site": site})
 
     separator = "-" * 80
     su_tickets = []
@@ -252,5 +166,59 @@ def main():
 
     print("-" * 80)
 
+
+def main():
+    args = parse_args()
+
+    statuses = []
+    for status in args.status.split(','):
+        if status!='open':
+            status='terminal'
+        if status not in statuses:
+            statuses.append(status)
+    # An empty site (-l '') searches all sites of the support unit.
+    sites = [site for site in args.site.split(',') if site] or [""]
+
+    ggus = ggus_client.GGUSClient(args.username, args.password, args.cookies)
+    # Log in before the searches start, instead of in each of them.
+    if not ggus.session.cookies:
+        ggus.login()
+
+    def search(query):
+        (site, status) = query
+        if status=='open':
+            timeframe='any'
+        else:
+            timeframe='lastmonth'
+        try:
+            return [GGUSTicket(fields, args.support_unit)
+                    for fields in ggus.tickets(GGUSTicket.tags, args.support_unit,
+                                               site, status, timeframe)]
+        except Exception as e:
+            return e
+
+    # All searches at once over the one session; the reports are printed
+    # in the order of the arguments.
+    queries = [(site, status) for status in statuses for site in sites]
+    pool = ThreadPool(max(1, min(args.workers, len(queries))))
+    results = pool.map(search, queries)
+    pool.close()
+
+    failed = 0
+    printed = False
+    for ((site, status), tickets) in zip(queries, results):
+        if isinstance(tickets, Exception):
+            print("Could not get the %s tickets of %s: %s" % (status, site, tickets),
+                  file=sys.stderr)
+            failed += 1
+            continue
+        if printed:
+            print()
+        report(site, status, tickets, args.reverse)
+        printed = True
+
+    if failed:
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
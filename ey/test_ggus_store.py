@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Tests of the GGUS ticket store of ggus_store.py.
+#
+# Usage:
+# $ python -m unittest test_ggus_store
+
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import ggus_store
+
+
+def ticket(ticket_id, status="assigned", site="SARA-MATRIX", last_update="2018-05-28 12:00:00"):
+    """A ticket as a tuple of ggus_store.TAGS."""
+    return (str(ticket_id), site, last_update, status, "Subject %d" % ticket_id,
+            "USER", "EGI", "vo")
+
+
+class FakeGGUS(object):
+    """Returns the given tickets for every search, and records the searches."""
+
+    def __init__(self, tickets):
+        self.tickets_found = tickets
+        self.searches = []
+
+    def tickets(self, tags, support_unit, status=None, timeframe=None, since=None):
+        self.searches.append((status, timeframe, since))
+        return [t for t in self.tickets_found
+                if (t[3] == "solved") == (status == "terminal")]
+
+
+class TicketStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="ggus-test-")
+        self.path = os.path.join(self.dir, "ggus.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_upgrade_old_database(self):
+        # ggus_new_tickets.py used to store only the IDs it mailed about,
+        # sometimes more than once.
+        conn = sqlite3.connect(self.path)
+        conn.execute("create table tickets (id int)")
+        conn.executemany("insert into tickets values (?)", [(1,), (2,), (2,)])
+        conn.commit()
+        conn.close()
+
+        store = ggus_store.TicketStore(self.path)
+        rows = store.conn.execute("select id, notified from tickets order by id").fetchall()
+        self.assertEqual(rows, [(1, 1), (2, 1)])
+
+        # The tickets of the old database are not new; a ticket it did not
+        # have is.
+        store.update([ticket(1), ticket(2), ticket(3)])
+        self.assertEqual([t[0] for t in store.take_new("SARA-MATRIX")], [3])
+        store.close()
+
+        # Opening the upgraded store again changes nothing.
+        store = ggus_store.TicketStore(self.path)
+        rows = store.conn.execute("select id, notified from tickets order by id").fetchall()
+        self.assertEqual(rows, [(1, 1), (2, 1), (3, 1)])
+        store.close()
+
+    def test_incremental_sync(self):
+        store = ggus_store.TicketStore(self.path)
+        self.assertEqual(store.watermark(), None)
+
+        ggus = FakeGGUS([ticket(1), ticket(2, status="solved")])
+        changed = ggus_store.sync(ggus, store, "NGI_NL")
+        self.assertEqual([t[0] for t in changed], [1, 2])
+        self.assertEqual(ggus.searches, [("open", "lastmonth", None),
+                                         ("terminal", "lastmonth", None)])
+        today = datetime.datetime.utcnow().date()
+        self.assertEqual(store.watermark(), today)
+
+        # After the first sync, only the changes since the watermark are
+        # searched, and only changed tickets are returned.
+        ggus = FakeGGUS([ticket(1), ticket(2, status="solved"),
+                         ticket(3, last_update="2018-05-29 08:00:00")])
+        changed = ggus_store.sync(ggus, store, "NGI_NL")
+        self.assertEqual([t[0] for t in changed], [3])
+        self.assertEqual(ggus.searches, [("open", None, today), ("terminal", None, today)])
+
+        ggus = FakeGGUS([])
+        ggus_store.sync(ggus, store, "NGI_NL", full=True)
+        self.assertEqual(ggus.searches, [("open", "lastmonth", None),
+                                         ("terminal", "lastmonth", None)])
+        store.close()
+
+    def test_update_history(self):
+        store = ggus_store.TicketStore(self.path)
+        store.update([ticket(1)])
+        store.update([ticket(1)])
+        store.update([ticket(1, status="in progress", last_update="2018-05-29 08:00:00")])
+        history = store.conn.execute("select id, status, last_update from history "
+                                     "order by rowid").fetchall()
+        self.assertEqual(history, [(1, "assigned", "2018-05-28 12:00:00"),
+                                   (1, "in progress", "2018-05-29 08:00:00")])
+        store.close()
+
+    def test_take_new(self):
+        store = ggus_store.TicketStore(self.path)
+        store.update([ticket(1), ticket(2), ticket(3, site="NIKHEF-ELPROD"),
+                      ticket(4, status="in progress")])
+        self.assertEqual([t[0] for t in store.take_new("SARA-MATRIX")], [2, 1])
+        self.assertEqual(store.take_new("SARA-MATRIX"), [])
+
+        # A ticket that loses the status is new again when it gets it back.
+        store.update([ticket(1, status="in progress")])
+        self.assertEqual(store.take_new("SARA-MATRIX"), [])
+        notified = dict(store.conn.execute("select id, notified from tickets"))
+        self.assertEqual(notified[1], 0)
+        self.assertEqual(notified[2], 1)
+        store.update([ticket(1, status="assigned")])
+        self.assertEqual([t[0] for t in store.take_new("SARA-MATRIX")], [1])
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
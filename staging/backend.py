@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+
+# Selects the gfal2 implementation used by the staging scripts.
+#
+# By default this is the real gfal2 Python bindings. With the environment
+# variable STAGING_BACKEND=fake, the scripts use the simulated SRM in
+# fakegfal2.py instead, so they can be tried and benchmarked without a
+# live SRM (see benchmark.py).
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os
+
+name = os.environ.get('STAGING_BACKEND', 'gfal2')
+
+if name == 'fake':
+    import fakegfal2 as gfal2
+elif name == 'gfal2':
+    import gfal2
+else:
+    raise ImportError('Unknown STAGING_BACKEND %s, use gfal2 or fake' % name)
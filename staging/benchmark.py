@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Benchmark of the staging scripts against the simulated SRM in
+# fakegfal2.py, to tune --chunksize and --workers and to catch
+# regressions without touching production tape.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os
+import re
+import sys
+import time
+import argparse
+import textwrap
+import tempfile
+import shutil
+import subprocess
+
+parser=argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+
+        This script will generate lists of fake SURLs and run stage.py,
+        state.py and release.py on them with STAGING_BACKEND=fake, so
+        that no SRM is needed (see fakegfal2.py).
+
+        Usage:
+        $ python benchmark.py --sizes 1000,10000,100000 --chunksize 5000 --workers 8
+
+        Steps:
+        stage   - stage.py --chunksize: submission of the stage requests
+        poll    - state.py --job: one poll of the files that are queued
+        summary - state.py --job --summary json: same, with aggregation
+        scan    - state.py --file --workers: locality of each file
+        release - release.py --job: release of all files
+
+        Script output:
+        For each list size and step: the wall time, the number of files
+        per second and the peak memory use (RSS) of the script.
+        '''))
+
+parser.add_argument('--sizes', action="store", dest="sizes", default='1000,10000,100000',
+    help='Comma separated list sizes. Default: 1000,10000,100000')
+
+parser.add_argument('--steps', action="store", dest="steps", default='stage,poll,summary,scan,release',
+    help='Comma separated steps to run. Default: stage,poll,summary,scan,release')
+
+parser.add_argument('--chunksize', action="store", dest="chunksize", type=int, default=5000,
+    help='--chunksize for stage.py and release.py. Default: 5000.')
+
+parser.add_argument('--workers', action="store", dest="workers", type=int, default=8,
+    help='--workers for all scripts. Default: 8.')
+
+parser.add_argument('--latency', action="store", dest="latency", type=float, default=0.02,
+    help='Simulated seconds per SRM request (FAKE_LATENCY). Default: 0.02.')
+
+parser.add_argument('--keep', action="store_true", dest="keep", default=False,
+    help='Keep the generated lists and journals.')
+
+args=parser.parse_args()
+
+here = os.path.dirname(os.path.abspath(__file__))
+env = dict(os.environ)
+env['STAGING_BACKEND'] = 'fake'
+env.setdefault('FAKE_LATENCY', str(args.latency))
+env.setdefault('FAKE_RECALL_TIME', '10')
+
+def generate(path, size):
+    f = open(path, 'w')
+    for i in xrange(size):
+        f.write('srm://srm.example.org/pnfs/example.org/data/bench/dir%03d/file%07d\n' % (i % 100, i))
+    f.close()
+
+def run(step, size, command):
+    """Run a script and report its wall time and peak RSS."""
+    out = tempfile.TemporaryFile()
+    start = time.time()
+    p = subprocess.Popen([sys.executable, os.path.join(here, command[0])] + command[1:],
+                         stdout=out, stderr=subprocess.STDOUT, env=env)
+    (_, status, usage) = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    print('%-8s %9d %9.2f %12.1f %10.1f %4d' % (step, size, elapsed, size / elapsed,
+                                              usage.ru_maxrss / 1024.0, os.WEXITSTATUS(status)))
+    sys.stdout.flush()
+    out.seek(0)
+    return out.read()
+
+steps = args.steps.split(',')
+workdir = tempfile.mkdtemp(prefix='staging-benchmark-')
+print('%-8s %9s %9s %12s %10s %4s' % ('step', 'files', 'seconds', 'files/s', 'RSS (MB)', 'exit'))
+
+try:
+    for size in [int(size) for size in args.sizes.split(',')]:
+        srmlist = os.path.join(workdir, 'bench%d.txt' % size)
+        jrnl = os.path.join(workdir, 'bench%d.db' % size)
+        generate(srmlist, size)
+        common = ['--journal', jrnl]
+        job = None
+        if 'stage' in steps or 'poll' in steps or 'summary' in steps or 'release' in steps:
+            output = run('stage', size, ['stage.py', '--file', srmlist, '--chunksize', str(args.chunksize),
+                                         '--workers', str(args.workers)] + common)
+            job = re.search(r'Job ID (\d+)', output).group(1)
+        if 'poll' in steps:
+            run('poll', size, ['state.py', '--job', job] + common)
+        if 'summary' in steps:
+            run('summary', size, ['state.py', '--job', job, '--summary', 'json'] + common)
+        if 'scan' in steps:
+            run('scan', size, ['state.py', '--file', srmlist, '--workers', str(args.workers),
+                               '--summary', 'json'])
+        if 'release' in steps:
+            run('release', size, ['release.py', '--job', job, '--chunksize', str(args.chunksize),
+                                  '--workers', str(args.workers)] + common)
+finally:
+    if args.keep:
+        print('Lists and journals kept in %s' % workdir)
+    else:
+        shutil.rmtree(workdir)
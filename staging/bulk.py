@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Helpers to run gfal2 calls for large lists of files from a pool of
+# worker threads, used by stage.py, state.py and release.py.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+from backend import gfal2
+import collections
+import errno
+import itertools
+import random
+import threading
+import time
+
+# Every worker thread holds its own gfal2 context; contexts are not
+# meant to be shared between threads.
+local = threading.local()
+
+def get_context():
+    if not hasattr(local, 'context'):
+        local.context = gfal2.creat_context()
+    return local.context
+
+def chunks(items, size):
+    """Split an iterable into (n, first, chunk) tuples of at most size items,
+    where first is the position of the first item of the chunk."""
+    it = iter(items)
+    first = 0
+    for n in itertools.count():
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield (n, first, chunk)
+        first += len(chunk)
+
+def imap(pool, func, items, window):
+    """Like pool.imap, but keeps at most window items in flight, so that
+    items are only read from the iterable when a worker is about to need
+    them. Results are returned in the order of the items."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# Errors that are worth another try: the SRM is busy or the connection broke.
+transient = (errno.EAGAIN, errno.EBUSY, errno.ETIMEDOUT, errno.ECONNREFUSED,
+             errno.ECONNRESET, errno.ECOMM, errno.EIO)
+
+def retry(func, attempts=3, delay=1.0):
+    """Call func() and retry on transient gfal2 errors, sleeping an
+    exponentially growing, randomised time in between so that the workers
+    don't hit the SRM in lockstep."""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except gfal2.GError as e:
+            if e.code not in transient or attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def release(token, surls, attempts=3):
+    """Release the pins of token on surls. Returns a list of
+    (surl, error message) of which the error message is None for the
+    files that were released."""
+    try:
+        errors = retry(lambda: get_context().release(surls, token), attempts)
+    except gfal2.GError as e:
+        return [(surl, e.message) for surl in surls]
+    return [(surl, error.message if error else None) for surl, error in zip(surls, errors)]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+# Release all pins of past staging runs.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os
+import sys
+import argparse
+import textwrap
+import itertools
+from multiprocessing.pool import ThreadPool
+
+import bulk
+import journal
+import srmlist
+
+parser=argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+
+        This script will release (UNPIN) the files of every token that
+        was recorded for a [srmlist], or for all past runs of stage.py
+        in a directory. Every time stage.py is run, a new pin is added
+        to the files; releasing the token of the last run only does not
+        free the disk space when older pins are still there.
+
+        Usage:
+        $ python cleanup.py --file [srmlist]
+        Releases all tokens of all jobs in the journal that staged
+        [srmlist].
+
+        $ python cleanup.py --dir [directory]
+        Releases all tokens in the manifests written by stage.py with
+        --chunksize ([srmlist].manifest) in [directory] and its
+        subdirectories. The [srmlist] named in each manifest must still
+        exist.
+
+        Script output:
+        For each token, the number of files released and the number
+        of files that could not be released. For the latter also:
+        "[surl] STILL PINNED by [token_id] : [error]"
+        Files for which the SRM answers that they are not pinned are
+        counted as released.
+
+        A rerun of stage.py on files that are already online gets no
+        token from the SRM, but may still add a pin. Such pins can not
+        be released by this script. The files are listed as:
+        "[surl] MAY STILL BE PINNED, no token"
+        and counted under "No token". They are released when their pin
+        lifetime expires, or by the SRM administrators.
+        The exit status is 2 if any file may still be pinned.
+        '''))
+
+source = parser.add_mutually_exclusive_group(required=True)
+
+source.add_argument('--file', action="store", dest="file",
+    help='Release all tokens recorded in the journal for this file with SURLs.')
+
+source.add_argument('--dir', action="store", dest="dir",
+    help='Release all tokens in the stage.py manifests in this directory.')
+
+parser.add_argument('--journal', action="store", dest="journal", default=journal.default_path,
+    help='Journal with the jobs recorded by stage.py. Default: %s' % journal.default_path)
+
+parser.add_argument('--chunksize', action="store", dest="chunksize", type=int, default=1000,
+    help='Number of files per release request. Default: 1000.')
+
+parser.add_argument('--workers', action="store", dest="workers", type=int, default=4,
+    help='Number of release requests submitted in parallel. Default: 4.')
+
+args=parser.parse_args()
+
+if args.chunksize < 1 or args.workers < 1:
+    parser.error('--chunksize and --workers must be at least 1')
+
+out = srmlist.Output()
+
+def journal_tokens(jrnl, path):
+    """Yield (token, [(file_id, surl)]) for the jobs that staged path.
+    The token is None for the files that were online and got no token."""
+    jobs = jrnl.jobs(os.path.abspath(path))
+    if not jobs:
+        sys.stderr.write('No jobs found for %s in %s\n' % (path, args.journal))
+    for job in jobs:
+        for (token_id, chunk, token) in jrnl.tokens(job):
+            if not token:
+                files = jrnl.files(job, token_id, statuses=(journal.ONLINE,))
+                yield (None, [(file_id, surl) for (file_id, _, surl, _, _) in files])
+                continue
+            files = jrnl.files(job, token_id, statuses=(journal.QUEUED, journal.READY, journal.FAILED))
+            yield (token, [(file_id, surl) for (file_id, _, surl, _, _) in files])
+
+def manifest_tokens(directory):
+    """Yield (token, [(None, surl)]) for the chunks in all manifests.
+    The token is None for the chunks that were online and got no token."""
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        for name in sorted(filenames):
+            if not name.endswith('.manifest'):
+                continue
+            manifest = os.path.join(dirpath, name)
+            f = open(manifest, 'r')
+            header = f.readline()
+            entries = []
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                (chunk, first, count, token) = line.split()
+                entries.append((int(first), int(count), token))
+            f.close()
+            prefix = '# stage.py manifest for '
+            if not header.startswith(prefix):
+                sys.stderr.write('Skipping %s: not a stage.py manifest\n' % manifest)
+                continue
+            path = header[len(prefix):].strip()
+            if not os.path.isabs(path):
+                path = os.path.join(dirpath, os.path.basename(path))
+            if not os.path.isfile(path):
+                sys.stderr.write('Skipping %s: %s not found\n' % (manifest, path))
+                continue
+            # The chunks are consecutive parts of the [srmlist].
+            surls = srmlist.read(path)
+            position = 0
+            for (first, count, token) in sorted(entries):
+                chunk = list(itertools.islice(surls, first - position, first - position + count))
+                position = first + count
+                if token == '-':
+                    yield (None, [(None, surl) for surl in chunk])
+                elif token != 'FAILED':
+                    yield (token, [(None, surl) for surl in chunk])
+
+def not_pinned(message):
+    message = message.lower()
+    return 'not pinned' in message or 'not yet pinned' in message
+
+if args.file is not None:
+    jrnl = journal.Journal(args.journal)
+    sources = journal_tokens(jrnl, args.file)
+else:
+    jrnl = None
+    sources = manifest_tokens(args.dir)
+
+def tasks():
+    seen = set()
+    for (token, files) in sources:
+        if token is not None:
+            if token in seen:
+                continue
+            seen.add(token)
+        for (n, first, part) in bulk.chunks(files, args.chunksize):
+            yield (token, part)
+
+def release_task(task):
+    (token, files) = task
+    if token is None:
+        return (token, files, None)
+    return (token, files, bulk.release(token, [surl for (_, surl) in files]))
+
+pool = ThreadPool(args.workers)
+
+totals = {}
+n_pinned = 0
+for (token, files, results) in bulk.imap(pool, release_task, tasks(), window=2 * args.workers):
+    (released, pinned) = totals.setdefault(token, (0, 0))
+    updates = []
+    if results is None:
+        for (_, surl) in files:
+            out.write("%s MAY STILL BE PINNED, no token" % surl)
+        totals[token] = (released, pinned + len(files))
+        n_pinned += len(files)
+        continue
+    for (file_id, _), (surl, message) in zip(files, results):
+        if message and not not_pinned(message):
+            out.write("%s STILL PINNED by %s : %s" % (surl, token, message))
+            pinned += 1
+        else:
+            released += 1
+            if file_id is not None:
+                updates.append((file_id, journal.RELEASED, None))
+    totals[token] = (released, pinned)
+    n_pinned += pinned
+    if jrnl and updates:
+        jrnl.update(updates)
+
+pool.close()
+pool.join()
+if jrnl:
+    jrnl.close()
+
+for token in sorted(totals):
+    (released, pinned) = totals[token]
+    if token is None:
+        out.write("No token: %d files may still be pinned" % pinned)
+    else:
+        out.write("Token %s: %d released, %d still pinned" % (token, released, pinned))
+out.flush()
+
+if n_pinned:
+    sys.exit(2)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# A simulated SRM with the part of the gfal2 API that the staging scripts
+# use. Select it with STAGING_BACKEND=fake (see backend.py).
+#
+# The simulation keeps no state, so that stage.py, state.py and release.py
+# can be run one after the other as separate processes: the locality,
+# recall delay and failure of a file are derived from a hash of its SURL,
+# and a token carries the time of its stage request. It is tuned with
+# these environment variables:
+#
+#   FAKE_LATENCY        seconds per request (default 0.05)
+#   FAKE_FILE_LATENCY   additional seconds per file in a request (default 0)
+#   FAKE_RECALL_TIME    maximum seconds to recall a file from tape (default 60)
+#   FAKE_ONLINE_RATE    fraction of the files that is on disk (default 0.1)
+#   FAKE_FAILURE_RATE   fraction of the files that fails to recall (default 0.01)
+#   FAKE_BUSY_RATE      fraction of the requests that fails with EAGAIN,
+#                       as a busy SRM does (default 0)
+#   FAKE_BUSY_EVERY     also fail every n-th request of a process with
+#                       EAGAIN, to make a test fail a given request
+#                       (default 0: none)
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import errno
+import itertools
+import os
+import random
+import time
+import zlib
+
+latency = float(os.environ.get('FAKE_LATENCY', 0.05))
+file_latency = float(os.environ.get('FAKE_FILE_LATENCY', 0))
+recall_time = float(os.environ.get('FAKE_RECALL_TIME', 60))
+online_rate = float(os.environ.get('FAKE_ONLINE_RATE', 0.1))
+failure_rate = float(os.environ.get('FAKE_FAILURE_RATE', 0.01))
+busy_rate = float(os.environ.get('FAKE_BUSY_RATE', 0))
+busy_every = int(os.environ.get('FAKE_BUSY_EVERY', 0))
+
+requests = itertools.count(1)
+
+
+class GError(Exception):
+
+    def __init__(self, message, code):
+        Exception.__init__(self, message)
+        self.message = message
+        self.code = code
+
+
+def creat_context():
+    return Context()
+
+
+def fraction(surl, salt):
+    """A number in [0, 1) that is fixed for a SURL and salt."""
+    return (zlib.crc32(salt + surl) & 0xffffffff) / 4294967296.0
+
+
+def online(surl):
+    return fraction(surl, 'online') < online_rate
+
+
+def failing(surl):
+    return not online(surl) and fraction(surl, 'failure') < failure_rate
+
+
+class Context(object):
+
+    def request(self, n_files):
+        time.sleep(latency + file_latency * n_files)
+        n = next(requests)
+        if (busy_rate and random.random() < busy_rate) or (busy_every and n % busy_every == 0):
+            raise GError('[SE][srmRequest] SRM is busy, try again later', errno.EAGAIN)
+
+    def token_time(self, token):
+        try:
+            (prefix, created, _) = token.split(':')
+            if prefix != 'fake':
+                raise ValueError
+            return float(created)
+        except ValueError:
+            raise GError('[SE][StatusOfBringOnlineRequest][SRM_INVALID_REQUEST] unknown token %s' % token,
+                         errno.EINVAL)
+
+    def file_poll(self, surl, created):
+        if online(surl):
+            return None
+        if failing(surl):
+            return GError('[SE][StatusOfBringOnlineRequest][SRM_FAILURE] tape recall failed', errno.EIO)
+        if time.time() - created >= recall_time * fraction(surl, 'recall'):
+            return None
+        return GError('[SE][StatusOfBringOnlineRequest][SRM_REQUEST_INPROGRESS] queued', errno.EAGAIN)
+
+    def bring_online(self, surls, pintime, timeout, asynchronous):
+        single = isinstance(surls, basestring)
+        if single:
+            surls = [surls]
+        self.request(len(surls))
+        if all(online(surl) for surl in surls):
+            # Like the real gfal2: no token when all files are online.
+            token = ''
+        else:
+            token = 'fake:%f:%08x' % (time.time(), random.getrandbits(32))
+        status = [0 for surl in surls]
+        if single:
+            return (status[0], token)
+        return (status, token)
+
+    def bring_online_poll(self, surls, token):
+        single = isinstance(surls, basestring)
+        if single:
+            surls = [surls]
+        self.request(len(surls))
+        created = self.token_time(token)
+        errors = [self.file_poll(surl, created) for surl in surls]
+        if single:
+            if errors[0] and errors[0].code != errno.EAGAIN:
+                raise errors[0]
+            return 0 if errors[0] else 1
+        return errors
+
+    def release(self, surls, token):
+        single = isinstance(surls, basestring)
+        if single:
+            surls = [surls]
+        self.request(len(surls))
+        self.token_time(token)
+        errors = [None for surl in surls]
+        if single:
+            return 0
+        return errors
+
+    def getxattr(self, surl, name):
+        self.request(1)
+        if name == 'user.status':
+            if online(surl):
+                return 'ONLINE_AND_NEARLINE'
+            return 'NEARLINE '
+        if name == 'user.tape':
+            return 'T%04d' % (fraction(surl, 'tape') * 100)
+        raise GError('[SE] no such attribute %s' % name, errno.ENODATA)
+
+    def stat(self, surl):
+        self.request(1)
+        return Stat(int(fraction(surl, 'size') * 4e9))
+
+
+class Stat(object):
+
+    def __init__(self, st_size):
+        self.st_size = st_size
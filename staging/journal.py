@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Local journal of stage requests, shared by stage.py, state.py and release.py.
+#
+# stage.py records every run as a job with the tokens it got back and the
+# SURLs belonging to each token. state.py and release.py can then work on
+# a job ID instead of a [srmlist] and a token, and only have to ask the SRM
+# about files that did not reach a terminal state yet.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os
+import sqlite3
+import time
+
+default_path = os.environ.get('STAGING_JOURNAL',
+                              os.path.expanduser('~/.staging_journal.db'))
+
+# File states. QUEUED files are still being fetched from tape, all others
+# will not change anymore unless the files are staged or released again.
+QUEUED = 'QUEUED'
+READY = 'READY'
+FAILED = 'FAILED'
+ONLINE = 'ONLINE'
+RELEASED = 'RELEASED'
+
+terminal = (READY, FAILED, ONLINE, RELEASED)
+
+schema = '''
+create table if not exists jobs (
+    id      integer primary key,
+    srmlist text,
+    created real
+);
+create table if not exists tokens (
+    id      integer primary key,
+    job     integer not null references jobs (id),
+    chunk   integer not null,
+    token   text
+);
+create table if not exists files (
+    id      integer primary key,
+    job     integer not null references jobs (id),
+    token   integer references tokens (id),
+    surl    text not null,
+    status  text not null,
+    error   text,
+    updated real
+);
+create index if not exists files_job_status on files (job, status);
+'''
+
+
+class Journal(object):
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def new_job(self, srmlist):
+        c = self.db.execute('insert into jobs (srmlist, created) values (?, ?)',
+                            (srmlist, time.time()))
+        self.db.commit()
+        return c.lastrowid
+
+    def job(self, job):
+        return self.db.execute('select id, srmlist, created from jobs where id = ?',
+                               (job,)).fetchone()
+
+    def jobs(self, srmlist=None):
+        """Return the IDs of all jobs, or of the jobs that staged srmlist."""
+        if srmlist is None:
+            rows = self.db.execute('select id from jobs order by id')
+        else:
+            rows = self.db.execute('select id from jobs where srmlist = ? order by id', (srmlist,))
+        return [job for (job,) in rows]
+
+    def add_chunk(self, job, chunk, token, surls, status, error=None):
+        """Record one stage request (chunk) of a job and its files."""
+        c = self.db.execute('insert into tokens (job, chunk, token) values (?, ?, ?)',
+                            (job, chunk, token or None))
+        token_id = c.lastrowid
+        now = time.time()
+        self.db.executemany(
+            'insert into files (job, token, surl, status, error, updated) values (?, ?, ?, ?, ?, ?)',
+            ((job, token_id, surl, status, error, now) for surl in surls))
+        self.db.commit()
+        return token_id
+
+    def tokens(self, job):
+        """Return (token_id, chunk, token) for all stage requests of a job."""
+        return self.db.execute('select id, chunk, token from tokens where job = ? order by chunk',
+                               (job,)).fetchall()
+
+    def files(self, job, token_id=None, statuses=None):
+        """Iterate over (file_id, token_id, surl, status, error) of a job,
+        in the order the files were staged. Optionally limited to one token
+        and/or to the given states."""
+        query = 'select id, token, surl, status, error from files where job = ?'
+        params = [job]
+        if token_id is not None:
+            query += ' and token = ?'
+            params.append(token_id)
+        if statuses is not None:
+            query += ' and status in (%s)' % ','.join('?' * len(statuses))
+            params.extend(statuses)
+        return self.db.execute(query + ' order by id', params)
+
+    def pending(self, job, token_id=None):
+        """Iterate over the files of a job that are not in a terminal state."""
+        return self.files(job, token_id, statuses=(QUEUED,))
+
+    def update(self, updates):
+        """Store new states. updates is an iterable of (file_id, status, error)."""
+        now = time.time()
+        self.db.executemany('update files set status = ?, error = ?, updated = ? where id = ?',
+                            ((status, error, now, file_id) for (file_id, status, error) in updates))
+        self.db.commit()
+
+    def counts(self, job):
+        """Return a dict with the number of files per state for a job."""
+        return dict(self.db.execute('select status, count(*) from files where job = ? group by status',
+                                    (job,)).fetchall())
@@ -5,12 +5,19 @@
 # Support:
 #    Contact <helpdesk@surfsara.nl>
 
-import gfal2
+from backend import gfal2
 import errno
+import os
 import sys
 import time
 import argparse
 import textwrap
+import random
+from multiprocessing.pool import ThreadPool
+
+import bulk
+import journal
+import srmlist
 
 parser=argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -28,40 +35,195 @@ parser=argparse.ArgumentParser(
         "UNPINNED" or "FAILED to UNPIN" ==>
         Returns for each file in the [srmlist] whether it was 
         successfully released.
+        The [srmlist] may be gzip-compressed or '-' to read from stdin.
+        Blank lines, lines starting with '#' and duplicate SURLs are
+        skipped.
+
+        Alternatively, release all tokens of a job recorded by stage.py:
+        $ python release.py --job [job_id]
+        The tokens and files are taken from the journal, so no check
+        of the token against the [srmlist] is needed. Files that were
+        released before are skipped.
+
+        The files are released in chunks (--chunksize) by --workers
+        parallel requests. With --file and --token, every chunk is
+        first checked against the token with a single poll request;
+        with --sample only that many random files of each chunk are
+        checked. Files that fail the check are not released. The
+        chunks that were released without errors are logged to a
+        progress file ([srmlist].released by default); rerun with
+        --resume to skip them after an interruption.
+
+        If files could not be released, the script exits with status 2.
+        With --job, the chunks without a token (all files were online or
+        the stage request failed) are listed on stderr.
         '''))
 
-parser.add_argument('--file', action="store", dest="file", required=True,
-    help='File containing file names already staged starting with: srm://...')
+parser.add_argument('--file', action="store", dest="file", required=False,
+    help='File containing file names already staged starting with: srm://... Use - for stdin.')
 
-parser.add_argument('--token', action="store", dest="token", required=True,
+parser.add_argument('--token', action="store", dest="token", required=False,
     help='Stage request token printed by stage.py upon staging.')
 
+parser.add_argument('--job', action="store", dest="job", type=int, required=False,
+    help='Job ID printed by stage.py. Replaces --file and --token.')
+
+parser.add_argument('--journal', action="store", dest="journal", default=journal.default_path,
+    help='Journal with the jobs recorded by stage.py. Default: %s' % journal.default_path)
+
+parser.add_argument('--chunksize', action="store", dest="chunksize", type=int, default=1000,
+    help='Number of files per release request. Default: 1000.')
+
+parser.add_argument('--workers', action="store", dest="workers", type=int, default=4,
+    help='Number of release requests submitted in parallel. Default: 4.')
+
+parser.add_argument('--sample', action="store", dest="sample", type=int, required=False,
+    help='Check only this many random files per chunk against the token. Default: check all files.')
+
+parser.add_argument('--progress', action="store", dest="progress", required=False,
+    help='File to log the released chunks to with --file. Default: [srmlist].released')
+
+parser.add_argument('--resume', action="store_true", dest="resume", default=False,
+    help='Skip the chunks that are logged as released in the progress file.')
+
 args=parser.parse_args()
 
-surls=[]
-f=open(args.file,'r')
-surls=f.read().splitlines()
-f.close()
-
-context = gfal2.creat_context()
-
-try:
-    #check if the [token_id] corresponds to the correct [srmlist] brought online, else exit
-    for surl in surls:
-        context.bring_online_poll(surl, args.token)
-
-    # release(surls, token)
-    # Parameters:
-    #   surls is the given [srmlist] argument
-    #   token is the given [token_id] argument (returned by stage.py)
-    errors=context.release(surls, args.token)
-    for surl, error in zip(surls, errors):
-        if error:
-             print "%s => FAILED to UNPIN : %s" % (surl, error.message)
-        else:
-             print "%s UNPINNED " % surl
-except gfal2.GError as e:
-    print("Could not release the files:")
-    print("\t", e.message)
-    print("\t Code", e.code)
+if args.job is None and (args.file is None or args.token is None):
+    parser.error('either --job or both --file and --token are required')
+if args.job is not None and (args.file is not None or args.token is not None):
+    parser.error('--job can not be combined with --file or --token')
+if args.chunksize < 1 or args.workers < 1 or (args.sample is not None and args.sample < 1):
+    parser.error('--chunksize, --workers and --sample must be at least 1')
+
+out = srmlist.Output()
+
+def release_chunk(task):
+    """Release one chunk of files of a token. Returns the chunk with a list
+    of (surl, error message) of which the error message is None for files
+    that were released."""
+    (n, token, surls, verify) = task
+    context = bulk.get_context()
+    try:
+        rejected = {}
+        if verify:
+            # bring_online_poll checks the files against the token, which
+            # release does not do.
+            if args.sample and args.sample < len(surls):
+                checked = random.sample(surls, args.sample)
+            else:
+                checked = surls
+            errors = context.bring_online_poll(checked, token)
+            for surl, error in zip(checked, errors):
+                if error and error.code != errno.EAGAIN:
+                    rejected[surl] = 'token check failed: %s' % error.message
+            if rejected and checked is not surls:
+                # A sample can't tell which other files are wrong.
+                return (n, [(surl, rejected.get(surl, 'token check failed for this chunk'))
+                            for surl in surls])
+        accepted = [surl for surl in surls if surl not in rejected]
+        released = dict(bulk.release(token, accepted)) if accepted else {}
+        return (n, [(surl, rejected[surl] if surl in rejected else released[surl])
+                    for surl in surls])
+    except gfal2.GError as e:
+        return (n, [(surl, e.message) for surl in surls])
+
+def report(surl, message):
+    if message:
+        out.write("%s => FAILED to UNPIN : %s" % (surl, message))
+    else:
+        out.write("%s UNPINNED " % surl)
+
+pool = ThreadPool(args.workers)
+
+if args.job is not None:
+
+    jrnl = journal.Journal(args.journal)
+    if jrnl.job(args.job) is None:
+        sys.stderr.write('Job %d not found in %s\n' % (args.job, args.journal))
+        sys.exit(1)
+
+    def job_chunks():
+        for (token_id, chunk, token) in jrnl.tokens(args.job):
+            if not token:
+                # stage.py got no token because the files were online or
+                # the request failed; there is nothing to release them with.
+                counts = {}
+                for (_, _, _, status, _) in jrnl.files(args.job, token_id):
+                    counts[status] = counts.get(status, 0) + 1
+                sys.stderr.write('Chunk %d has no token, not released: %s\n'
+                                 % (chunk, ', '.join('%d %s' % (counts[status], status)
+                                                     for status in sorted(counts))))
+                continue
+            files = jrnl.files(args.job, token_id,
+                               statuses=(journal.QUEUED, journal.READY)).fetchall()
+            for (n, first, part) in bulk.chunks(files, args.chunksize):
+                yield ((token_id, n), token, part)
+
+    # The journal has the files of each token, so there's nothing to check.
+    files = {}
+    def tasks():
+        for (key, token, part) in job_chunks():
+            files[key] = part
+            yield (key, token, [surl for (_, _, surl, _, _) in part], False)
+
+    n_failed = 0
+    for (key, results) in bulk.imap(pool, release_chunk, tasks(), window=2 * args.workers):
+        updates = []
+        for (file_id, _, _, _, _), (surl, message) in zip(files.pop(key), results):
+            report(surl, message)
+            if message:
+                n_failed += 1
+            else:
+                updates.append((file_id, journal.RELEASED, None))
+        jrnl.update(updates)
+
+    pool.close()
+    pool.join()
+    jrnl.close()
+    out.flush()
+    if n_failed:
+        sys.stderr.write('%d files could not be released\n' % n_failed)
+        sys.exit(2)
+    sys.exit(0)
+
+# Log of released chunks, so that an interrupted run can be resumed.
+progress = args.progress or ('release' if args.file == '-' else args.file) + '.released'
+header = '# release.py progress for token %s chunksize %d\n' % (args.token, args.chunksize)
+done = set()
+if args.resume and os.path.exists(progress):
+    p = open(progress, 'r')
+    if p.readline() != header:
+        parser.error('%s is for another token or chunksize' % progress)
+    done = set(int(line) for line in p if line.strip())
+    p.close()
+    p = open(progress, 'a')
+else:
+    p = open(progress, 'w')
+    p.write(header)
+
+def tasks():
+    for (n, first, surls) in bulk.chunks(srmlist.read(args.file), args.chunksize):
+        if n not in done:
+            yield (n, args.token, surls, True)
+
+n_failed = 0
+for (n, results) in bulk.imap(pool, release_chunk, tasks(), window=2 * args.workers):
+    failed = 0
+    for (surl, message) in results:
+        report(surl, message)
+        if message:
+            failed += 1
+    out.flush()
+    # Chunks with failures are not logged, so that --resume retries them.
+    if not failed:
+        p.write('%d\n' % n)
+        p.flush()
+    n_failed += failed
+
+pool.close()
+pool.join()
+p.close()
+
+if n_failed:
+    sys.stderr.write('%d files could not be released\n' % n_failed)
     sys.exit(2)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Reading [srmlist] files and writing per-file output for stage.py,
+# state.py and release.py without holding more in memory than needed.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import atexit
+import gzip
+import hashlib
+import struct
+import sys
+import zlib
+
+gzip_magic = '\x1f\x8b'
+
+class Stdin(object):
+    """The lines of stdin, decompressed when it starts with the gzip magic
+    number. gzip.GzipFile needs to seek, which a pipe can't, so the data is
+    decompressed as a stream."""
+
+    def __init__(self, stream=sys.stdin, blocksize=65536):
+        self.stream = stream
+        self.blocksize = blocksize
+
+    def blocks(self):
+        data = self.stream.read(2)
+        if data != gzip_magic:
+            while data:
+                yield data
+                data = self.stream.read(self.blocksize)
+            return
+        # 16 + MAX_WBITS: with a gzip header and trailer.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while data:
+            block = decompressor.decompress(data)
+            # The next member of a concatenated gzip file.
+            while decompressor.unused_data:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                block += decompressor.decompress(data)
+            yield block
+            data = self.stream.read(self.blocksize)
+        yield decompressor.flush()
+
+    def __iter__(self):
+        rest = ''
+        for block in self.blocks():
+            lines = (rest + block).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if rest:
+            yield rest
+
+    def close(self):
+        pass
+
+def open_list(path):
+    """Open a [srmlist]: '-' is stdin, gzip-compressed files (and stdin)
+    are recognised by their magic number."""
+    if path == '-':
+        return Stdin()
+    f = open(path, 'rb')
+    magic = f.read(2)
+    f.seek(0)
+    if magic == gzip_magic:
+        f.close()
+        return gzip.open(path, 'rb')
+    return f
+
+def read(path, unique=True):
+    """Iterate over the SURLs in a [srmlist], skipping blank lines and
+    lines starting with '#'. With unique, SURLs that were seen before are
+    skipped, and their number is written to stderr at the end. Only a
+    64-bit hash of each SURL is kept for that, not the SURL itself."""
+    seen = set()
+    duplicates = 0
+    f = open_list(path)
+    try:
+        for line in f:
+            surl = line.strip()
+            if not surl or surl.startswith('#'):
+                continue
+            if unique:
+                key = struct.unpack('<q', hashlib.md5(surl).digest()[:8])[0]
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+            yield surl
+        if duplicates:
+            sys.stderr.write('Skipped %d duplicate SURLs in %s\n'
+                             % (duplicates, 'stdin' if path == '-' else path))
+    finally:
+        f.close()
+
+class Output(object):
+    """Collects output lines and writes them in batches instead of one
+    write per file."""
+
+    def __init__(self, stream=sys.stdout, batch=1000):
+        self.stream = stream
+        self.batch = batch
+        self.lines = []
+        atexit.register(self.flush)
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.stream.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+        self.stream.flush()
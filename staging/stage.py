@@ -7,12 +7,19 @@
 # Support:
 #    Contact <helpdesk@surfsara.nl>
 
-import gfal2
+from backend import gfal2
 import errno
+import os
 import sys
 import time
 import argparse
 import textwrap
+import csv
+from multiprocessing.pool import ThreadPool
+
+import bulk
+import journal
+import srmlist
 
 parser=argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -31,34 +38,210 @@ parser=argparse.ArgumentParser(
         A token [token_id] is returned when at least one of the [srmlist] 
         files is on tape.
         When all files are online, no token is returned.
+
+        The [srmlist] may be gzip-compressed or '-' to read from stdin.
+        Blank lines, lines starting with '#' and duplicate SURLs are
+        skipped.
+
+        Each run is recorded as a job in a local journal (see --journal),
+        together with the tokens and the files of each token:
+        "Job ID [job_id]" ==>
+        The [job_id] can be given to state.py and release.py instead
+        of the [srmlist] and [token_id].
+
+        For very large lists, the files can be submitted in chunks:
+        $ python stage.py --file [srmlist] --chunksize 5000 --workers 4
+        Each chunk is a separate stage request with its own token.
+        The tokens are written to a manifest file ([srmlist].manifest
+        by default) with one line per chunk:
+        [chunk] [first] [count] [token_id]
+        where [first] is the position of the first file of the chunk
+        in the [srmlist], [count] the number of files in the chunk and
+        [token_id] is "-" when no token was returned or "FAILED" when
+        the stage request failed.
+
+        When a list spans many tapes, the files can be grouped first so
+        that the files of each tape are requested together:
+        $ python stage.py --file [srmlist] --group-by [key]
+        Each group is submitted as its own stage request (or requests,
+        with --chunksize), one group after the other. [key] is one of:
+        dir          - group by the directory of the files
+        xattr:[name] - group by an extended attribute of the files,
+                       looked up with --workers parallel requests
+        csv:[file]   - group by a file-to-tape mapping from the site,
+                       a CSV file with lines: [surl or path],[tape]
+        Files without a key are submitted last. The whole [srmlist] is
+        read into memory for this. The grouped list is written to
+        [srmlist].grouped and the manifest refers to that list.
         '''))
 
 parser.add_argument('--file', action="store", dest="file", required=True,
-    help='File containing file names to be staged starting with: srm://...')
+    help='File containing file names to be staged starting with: srm://... Use - for stdin.')
+
+parser.add_argument('--chunksize', action="store", dest="chunksize", type=int, required=False,
+    help='Number of files per stage request. Optional. By default all files are submitted in one request.')
+
+parser.add_argument('--workers', action="store", dest="workers", type=int, default=4,
+    help='Number of stage requests submitted in parallel when --chunksize is given. Default: 4.')
+
+parser.add_argument('--manifest', action="store", dest="manifest", required=False,
+    help='File to write the chunk tokens to when --chunksize is given. Default: [srmlist].manifest')
+
+parser.add_argument('--journal', action="store", dest="journal", default=journal.default_path,
+    help='Journal to record the stage requests in. Default: %s' % journal.default_path)
+
+parser.add_argument('--group-by', action="store", dest="group_by", required=False,
+    help='Group the files by tape before staging: dir, xattr:[name] or csv:[file]. Optional.')
 
 args=parser.parse_args()
 
-surls=[]
-f=open(args.file,'r')
-surls=f.read().splitlines()
-f.close()
-
-context = gfal2.creat_context()
-
-try:
-    # bring_online(surls, pintime, timeout, async) 
-    # Parameters:
-    #   surls is the given [srmlist] argument
-    #   pintime in seconds (how long should the file stay PINNED), e.g. value 604800 will pin files for a week
-    #   timeout of request in seconds
-    #   async is asynchronous request (does not block if != 0)
-    (status, token) = context.bring_online(surls, 300, 86400, True)
-    if token:
-        print("Got token %s" % token)
+if args.workers < 1 or (args.chunksize is not None and args.chunksize < 1):
+    parser.error('--chunksize and --workers must be at least 1')
+if args.group_by is not None:
+    (group_kind, _, group_arg) = args.group_by.partition(':')
+    if group_kind not in ('dir', 'xattr', 'csv') or (group_kind != 'dir' and not group_arg):
+        parser.error('--group-by must be dir, xattr:[name] or csv:[file]')
+
+# bring_online(surls, pintime, timeout, async)
+# Parameters:
+#   surls is the given [srmlist] argument
+#   pintime in seconds (how long should the file stay PINNED), e.g. value 604800 will pin files for a week
+#   timeout of request in seconds
+#   async is asynchronous request (does not block if != 0)
+pintime=300
+timeout=86400
+
+def surl_path(surl):
+    """Return the path of a SURL, as used in a file-to-tape mapping."""
+    if '?SFN=' in surl:
+        return surl.split('?SFN=', 1)[1]
+    (scheme, sep, rest) = surl.partition('://')
+    if not sep:
+        return surl
+    return '/' + rest.partition('/')[2]
+
+def group_keys(surls):
+    """Return the --group-by key of each SURL, '' when there is none."""
+    if group_kind == 'dir':
+        return [surl.rsplit('/', 1)[0] for surl in surls]
+    if group_kind == 'csv':
+        mapping = {}
+        f = open(group_arg, 'r')
+        for row in csv.reader(f):
+            if len(row) >= 2 and not row[0].startswith('#'):
+                mapping[row[0].strip()] = row[1].strip()
+        f.close()
+        return [mapping.get(surl, mapping.get(surl_path(surl), '')) for surl in surls]
+    def lookup(surl):
+        try:
+            return bulk.retry(lambda: bulk.get_context().getxattr(surl, group_arg)).strip()
+        except gfal2.GError:
+            return ''
+    pool = ThreadPool(args.workers)
+    keys = pool.map(lookup, surls, chunksize=16)
+    pool.close()
+    pool.join()
+    return keys
+
+def group(surls):
+    """Return the lists of files per group, in the order to stage them."""
+    groups = {}
+    for surl, key in zip(surls, group_keys(surls)):
+        groups.setdefault(key, []).append(surl)
+    return [(key, groups[key]) for key in sorted(groups, key=lambda key: (key == '', key))]
+
+jrnl = journal.Journal(args.journal)
+job = jrnl.new_job(args.file if args.file == '-' else os.path.abspath(args.file))
+print("Job ID %d" % job)
+
+if args.chunksize is None and args.group_by is None:
+
+    surls = list(srmlist.read(args.file))
+    context = gfal2.creat_context()
+
+    try:
+        (status, token) = context.bring_online(surls, pintime, timeout, True)
+        if token:
+            jrnl.add_chunk(job, 0, token, surls, journal.QUEUED)
+            print("Got token %s" % token)
+        else:
+            jrnl.add_chunk(job, 0, None, surls, journal.ONLINE)
+            print("No token was returned. Are all files online? Check with state.py")
+        jrnl.close()
+    except gfal2.GError as e:
+        jrnl.add_chunk(job, 0, None, surls, journal.FAILED, e.message)
+        jrnl.close()
+        print("Could not bring the files online:")
+        print("\t", e.message)
+        print("\t Code", e.code)
+        sys.exit(1)
+
+else:
+
+    def stage_chunk(chunk):
+        (n, first, surls) = chunk
+        try:
+            (status, token) = bulk.get_context().bring_online(surls, pintime, timeout, True)
+            return (n, first, surls, token, None)
+        except gfal2.GError as e:
+            return (n, first, surls, None, e)
+
+    base = 'stage' if args.file == '-' else args.file
+    srmlist_path = args.file if args.file == '-' else os.path.abspath(args.file)
+
+    if args.group_by is None:
+        chunks = bulk.chunks(srmlist.read(args.file), args.chunksize)
     else:
-        print("No token was returned. Are all files online? Check with state.py")
-except gfal2.GError as e:
-    print("Could not bring the files online:")
-    print("\t", e.message)
-    print("\t Code", e.code)
-    sys.exit(1)
+        groups = group(list(srmlist.read(args.file)))
+        # The manifest refers to positions in the list, so write the list
+        # in the order the files are staged.
+        srmlist_path = os.path.abspath(base + '.grouped')
+        g = open(srmlist_path, 'w')
+        for (key, surls) in groups:
+            print("Group %s: %d files" % (key or '(none)', len(surls)))
+            g.write('\n'.join(surls) + '\n')
+        g.close()
+
+        def grouped_chunks():
+            n = 0
+            first = 0
+            for (key, surls) in groups:
+                for (_, _, chunk) in bulk.chunks(surls, args.chunksize or len(surls)):
+                    yield (n, first, chunk)
+                    n += 1
+                    first += len(chunk)
+        chunks = grouped_chunks()
+
+    manifest = args.manifest or base + '.manifest'
+    m = open(manifest, 'w')
+    m.write('# stage.py manifest for %s\n' % srmlist_path)
+    m.write('# chunk first count token\n')
+
+    n_failed = 0
+    pool = ThreadPool(args.workers)
+    for (n, first, chunk, token, error) in bulk.imap(pool, stage_chunk, chunks, window=2 * args.workers):
+        count = len(chunk)
+        if error:
+            jrnl.add_chunk(job, n, None, chunk, journal.FAILED, error.message)
+            n_failed += 1
+            print("Could not bring chunk %d (files %d-%d) online:" % (n, first, first + count - 1))
+            print("\t %s" % error.message)
+            print("\t Code %s" % error.code)
+            token = 'FAILED'
+        elif token:
+            jrnl.add_chunk(job, n, token, chunk, journal.QUEUED)
+            print("Got token %s for chunk %d (files %d-%d)" % (token, n, first, first + count - 1))
+        else:
+            jrnl.add_chunk(job, n, None, chunk, journal.ONLINE)
+            print("No token was returned for chunk %d (files %d-%d). Are all files online? Check with state.py" % (n, first, first + count - 1))
+            token = '-'
+        m.write('%d %d %d %s\n' % (n, first, count, token))
+        m.flush()
+    pool.close()
+    pool.join()
+    m.close()
+
+    print("Tokens written to %s" % manifest)
+    jrnl.close()
+    if n_failed:
+        sys.exit(1)
@@ -7,12 +7,19 @@
 # Support: 
 #    Contact <helpdesk@surfsara.nl> 	
 
-import gfal2
+from backend import gfal2
 import errno
 import sys
 import time
 import argparse
 import textwrap
+import csv
+import json
+from multiprocessing.pool import ThreadPool
+
+import bulk
+import journal
+import srmlist
 
 parser=argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -29,6 +36,13 @@ parser=argparse.ArgumentParser(
         ONLINE: means that the file is only on disk
         NEARLINE: means that the file in only on tape
         ONLINE_AND_NEARLINE: means that the file in on disk and tape
+        ERROR: the status could not be retrieved
+
+        Without --token, each file is looked up separately. For large
+        lists, use --workers to look up several files in parallel:
+	$ python state.py --file [srmlist] --workers 16
+        The output stays in the order of the [srmlist]. Lookups that
+        fail because the SRM is busy are retried (--retries).
 
         If --token is specified, usage:
 	$ python state.py --file [srmlist] --token [token_id] 
@@ -38,33 +52,317 @@ parser=argparse.ArgumentParser(
         QUEUED: the file is being fetched from tape (PINNING)
         FAILED: could not get the file from tape
         READY: file is online (PINNED)
+
+        If --job is specified, usage:
+	$ python state.py --job [job_id]
+        The [job_id] is the identifier printed by stage.py. Only the
+        files that were not READY or FAILED at the previous check are
+        polled, using the tokens recorded in the journal. Besides the
+        states above, the output can contain:
+        ONLINE: no token was returned because the file was online
+        RELEASED: the file was released with release.py
+
+        With --token or --job, --wait keeps polling until all files
+        are READY or FAILED:
+	$ python state.py --job [job_id] --wait
+        Each file is printed once, when it reaches its final state.
+        Only the files that are still queued are polled. The interval
+        between polls is halved when files became ready since the
+        previous poll and doubled (up to --max-sleep) when not.
+        After each poll a progress line with the recall rate and the
+        estimated time left is written to stderr. With --sizes, the
+        size of every file that becomes READY is looked up to report
+        the recall rate in bytes as well.
+        A poll that fails is retried, but --wait gives up (exit status
+        2) after --max-failures failed polls in a row, or at once when
+        the token or a file is invalid or may not be accessed.
         
+        The [srmlist] may be gzip-compressed or '-' to read from stdin.
+        Blank lines, lines starting with '#' and duplicate SURLs are
+        skipped.
+
         To summarize the output, use the script like this:
-        python state.py --file myfiles | awk '{print $2}' | sort | uniq --count
+        python state.py --file myfiles --summary json
+        Instead of a line per file, the number of files per state is
+        printed, in total and per directory. Use --depth to group by
+        the first [depth] directories of the path instead. With
+        --summary csv, the output has a line per directory and a
+        column per state, followed by a line with the totals.
         '''))
 
-parser.add_argument('--file', action="store", dest="file", required=True,
-    help='File containing file names to be staged starting with: srm://...')
+source = parser.add_mutually_exclusive_group(required=True)
+
+source.add_argument('--file', action="store", dest="file",
+    help='File containing file names to be staged starting with: srm://... Use - for stdin.')
+
+source.add_argument('--job', action="store", dest="job", type=int,
+    help='Job ID printed by stage.py. Replaces --file and --token.')
 
 parser.add_argument('--token', action="store", dest="token", required=False,
     help='Stage request token printed by stage.py. Optional. It is faster for large srmlists.')
 
+parser.add_argument('--journal', action="store", dest="journal", default=journal.default_path,
+    help='Journal with the jobs recorded by stage.py. Default: %s' % journal.default_path)
+
+parser.add_argument('--wait', action="store_true", dest="wait", default=False,
+    help='Keep polling until all files are READY or FAILED. Requires --token or --job.')
+
+parser.add_argument('--max-sleep', action="store", dest="max_sleep", type=int, default=300,
+    help='Maximum number of seconds between two polls with --wait. Default: 300.')
+
+parser.add_argument('--max-failures', action="store", dest="max_failures", type=int, default=10,
+    help='With --wait, give up after this many polls in a row have failed. Default: 10.')
+
+parser.add_argument('--sizes', action="store_true", dest="sizes", default=False,
+    help='With --wait, also report the recall rate in bytes. Costs one stat per file.')
+
+parser.add_argument('--workers', action="store", dest="workers", type=int, default=1,
+    help='Number of files to look up in parallel without --token. Default: 1.')
+
+parser.add_argument('--retries', action="store", dest="retries", type=int, default=3,
+    help='Number of attempts per file without --token. Default: 3.')
+
+parser.add_argument('--summary', action="store", dest="summary", choices=('json', 'csv'), required=False,
+    help='Print the number of files per state and directory instead of the state of each file.')
+
+parser.add_argument('--depth', action="store", dest="depth", type=int, required=False,
+    help='With --summary, group by the first [depth] directories of the path. Default: the directory of the file.')
+
 args=parser.parse_args()
 
-surls=[]
-f=open(args.file,'r')
-surls=f.read().splitlines()
-f.close()
+if args.workers < 1 or args.retries < 1 or args.max_failures < 1:
+    parser.error('--workers, --retries and --max-failures must be at least 1')
+
+if args.job is not None and args.token is not None:
+    parser.error('--token can not be combined with --job')
+if args.wait and args.job is None and args.token is None:
+    parser.error('--wait requires --token or --job')
 
 context = gfal2.creat_context()
 
+out = srmlist.Output()
+
+# Number of files per bring_online_poll request with --file and --token.
+pollsize = 10000
+
+def poll_status(error, polling):
+    """Translate a bring_online_poll result to (status, message)."""
+    if error:
+        if error.code != errno.EAGAIN:
+            return (journal.FAILED, error.message)
+        return (journal.QUEUED, None)
+    elif not polling:
+        return (journal.QUEUED, None)
+    return (journal.READY, None)
+
+# Poll errors that will not go away by polling again, such as an unknown
+# or expired token, a missing file or a lapsed proxy.
+fatal_errors = (errno.ENOENT, errno.EINVAL, errno.EACCES, errno.EPERM)
+
+# States in the order they are shown by --summary csv.
+states = ('ONLINE', 'NEARLINE', 'ONLINE_AND_NEARLINE', 'QUEUED', 'READY', 'FAILED')
+
+class Summary(object):
+    """Counts files per state and directory prefix in a single pass,
+    without keeping the files themselves."""
+
+    def __init__(self, depth=None):
+        self.depth = depth
+        self.total = {}
+        self.prefixes = {}
+
+    def prefix(self, surl):
+        (scheme, sep, path) = surl.partition('://')
+        if not sep:
+            (scheme, path) = ('', surl)
+        (host, _, path) = path.partition('/')
+        dirs = path.split('/')[:-1]
+        if self.depth is not None:
+            dirs = dirs[:self.depth]
+        return scheme + sep + host + ''.join('/' + d for d in dirs)
+
+    def add(self, surl, status):
+        counts = self.prefixes.setdefault(self.prefix(surl), {})
+        counts[status] = counts.get(status, 0) + 1
+        self.total[status] = self.total.get(status, 0) + 1
+
+    def dump(self, stream, format):
+        if format == 'json':
+            json.dump({'total': self.total, 'directories': self.prefixes},
+                      stream, indent=2, sort_keys=True)
+            stream.write('\n')
+            return
+        columns = list(states) + sorted(set(self.total) - set(states))
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(['directory'] + columns)
+        for prefix in sorted(self.prefixes):
+            counts = self.prefixes[prefix]
+            writer.writerow([prefix] + [counts.get(state, 0) for state in columns])
+        writer.writerow(['total'] + [self.total.get(state, 0) for state in columns])
+
+summary = Summary(args.depth) if args.summary else None
+
+def finish():
+    out.flush()
+    if summary:
+        summary.dump(out.stream, args.summary)
+
+def print_status(surl, status, message=None):
+    if summary:
+        summary.add(surl, status)
+    elif message:
+        out.write("%s %s : %s" % (surl, status, message))
+    else:
+        out.write("%s %s" % (surl, status))
+
+def file_size(surl):
+    try:
+        return context.stat(surl).st_size
+    except gfal2.GError:
+        return 0
+
+def format_bytes(n):
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if n < 1000 or unit == 'TB':
+            return '%.1f %s' % (n, unit)
+        n /= 1000.0
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '%dh%02dm%02ds' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+class Progress(object):
+    """Keeps track of the recall rate while waiting for a stage request."""
+
+    def __init__(self, total, done):
+        self.start = time.time()
+        self.total = total
+        self.done_at_start = done
+        self.done = done
+        self.bytes = 0
+
+    def update(self, n_terminal, n_bytes):
+        self.done += n_terminal
+        self.bytes += n_bytes
+
+    def report(self, sleep_time):
+        minutes = max(time.time() - self.start, 1) / 60.0
+        files_per_min = (self.done - self.done_at_start) / minutes
+        line = '%s %d/%d files done, %.1f files/min' % (
+            time.strftime('%H:%M:%S'), self.done, self.total, files_per_min)
+        if args.sizes:
+            line += ', %s/min' % format_bytes(self.bytes / minutes)
+        if self.done < self.total:
+            if files_per_min > 0:
+                line += ', ETA %s' % format_duration((self.total - self.done) / files_per_min * 60)
+            line += ', next poll in %ds' % sleep_time
+        sys.stderr.write(line + '\n')
+
+def wait(poll, total, done):
+    """Call poll(update) until all files are terminal. poll calls
+    update(n_terminal, n_bytes) with the number of files that became
+    terminal and the number of bytes that became READY after each request,
+    so that the files of the requests before a failed one are counted."""
+    progress = Progress(total, done)
+    sleep_time = 1
+    failures = 0
+    while progress.done < progress.total:
+        done = progress.done
+        try:
+            poll(progress.update)
+            failures = 0
+        except gfal2.GError as e:
+            failures += 1
+            if e.code in fatal_errors or failures >= args.max_failures:
+                out.flush()
+                sys.stderr.write('Poll failed, giving up: %s (code %s)\n' % (e.message, e.code))
+                sys.exit(2)
+            sys.stderr.write('Poll failed, will retry: %s (code %s)\n' % (e.message, e.code))
+        out.flush()
+        if progress.done > done:
+            sleep_time = max(1, sleep_time // 2)
+        else:
+            sleep_time = min(args.max_sleep, sleep_time * 2)
+        progress.report(sleep_time)
+        if progress.done < progress.total:
+            time.sleep(sleep_time)
+
+if args.job is not None:
+
+    # Method 3: use the journal of stage.py and poll only the files that
+    # are still queued, one request per token.
+
+    jrnl = journal.Journal(args.journal)
+    if jrnl.job(args.job) is None:
+        sys.stderr.write('Job %d not found in %s\n' % (args.job, args.journal))
+        sys.exit(1)
+
+    def poll_job(report, update=lambda n_terminal, n_bytes: None):
+        for (token_id, chunk, token) in jrnl.tokens(args.job):
+            pending = jrnl.pending(args.job, token_id).fetchall()
+            if not pending or not token:
+                continue
+            errors = context.bring_online_poll([surl for (_, _, surl, _, _) in pending], token)
+            updates = []
+            n_terminal = 0
+            n_bytes = 0
+            for (file_id, _, surl, _, _), error in zip(pending, errors):
+                (status, message) = poll_status(error, polling=True)
+                if status == journal.QUEUED:
+                    continue
+                updates.append((file_id, status, message))
+                n_terminal += 1
+                if report:
+                    print_status(surl, status, message)
+                    if status == journal.READY and args.sizes:
+                        n_bytes += file_size(surl)
+            jrnl.update(updates)
+            update(n_terminal, n_bytes)
+
+    if args.wait:
+        counts = jrnl.counts(args.job)
+        n_queued = counts.get(journal.QUEUED, 0)
+        for (file_id, token_id, surl, status, message) in jrnl.files(args.job):
+            if status != journal.QUEUED:
+                print_status(surl, status, message)
+        out.flush()
+        wait(lambda update: poll_job(True, update), sum(counts.values()), sum(counts.values()) - n_queued)
+        jrnl.close()
+        finish()
+        sys.exit(0)
+
+    try:
+        poll_job(report=False)
+    except gfal2.GError as e:
+        out.write("Could not poll the files:")
+        out.write("\t %s" % e.message)
+        out.write("\t Code %s" % e.code)
+        out.flush()
+        sys.exit(2)
+
+    for (file_id, token_id, surl, status, message) in jrnl.files(args.job):
+        print_status(surl, status, message)
+    jrnl.close()
+    finish()
+    sys.exit(0)
+
 if args.token is None:
 
     # Method 1: get status for each file.
 
-    for surl in surls:
-        status = context.getxattr(surl, 'user.status')
-        print surl, status
+    def locality(surl):
+        try:
+            status = bulk.retry(lambda: bulk.get_context().getxattr(surl, 'user.status'),
+                                attempts=args.retries)
+            return (surl, status.strip(), None)
+        except gfal2.GError as e:
+            return (surl, 'ERROR', e.message)
+
+    pool = ThreadPool(args.workers)
+    for (surl, status, message) in bulk.imap(pool, locality, srmlist.read(args.file), window=16 * args.workers):
+        print_status(surl, status, message)
+    pool.close()
+    pool.join()
 
 else:
 
@@ -73,20 +371,48 @@ else:
     def evaluate_errors(errors, surls, polling):
         n_terminal = 0
         for surl, error in zip(surls, errors):
-            if error:
-                if error.code != errno.EAGAIN:
-                    print "%s FAILED : %s" % (surl, error.message)
-                    n_terminal += 1
-                else:
-                    print "%s QUEUED" % surl
-            elif not polling:
-                print "%s QUEUED" % surl
-            else:
+            (status, message) = poll_status(error, polling)
+            print_status(surl, status, message)
+            if status != journal.QUEUED:
                 n_terminal += 1
-                print "%s READY" % surl
         return n_terminal
 
-    sleep_time = 1
+    if args.wait:
+
+        pending = list(srmlist.read(args.file))
+        total = len(pending)
+
+        def poll_token(update):
+            global pending
+            still_queued = []
+            polled = 0
+            try:
+                for (n, first, surls) in bulk.chunks(pending, pollsize):
+                    errors = context.bring_online_poll(surls, args.token)
+                    n_terminal = 0
+                    n_bytes = 0
+                    for surl, error in zip(surls, errors):
+                        (status, message) = poll_status(error, polling=True)
+                        if status == journal.QUEUED:
+                            still_queued.append(surl)
+                            continue
+                        print_status(surl, status, message)
+                        n_terminal += 1
+                        if status == journal.READY and args.sizes:
+                            n_bytes += file_size(surl)
+                    polled = first + len(surls)
+                    update(n_terminal, n_bytes)
+            finally:
+                # After a failed request, the files from it on are polled again.
+                pending = still_queued + pending[polled:]
+
+        wait(poll_token, total, 0)
+
+    else:
+
+        n_terminal = 0
+        for (n, first, surls) in bulk.chunks(srmlist.read(args.file), pollsize):
+            errors = context.bring_online_poll(surls, args.token)
+            n_terminal += evaluate_errors(errors, surls, polling=True)
 
-    errors = context.bring_online_poll(surls, args.token)
-    n_terminal = evaluate_errors(errors, surls, polling=True)
+finish()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Tests of the staging scripts, run as separate processes against the
+# fake SRM of fakegfal2.py (see backend.py) with a journal of their own.
+#
+# Usage:
+# $ python -m unittest test_staging
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import gzip
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import journal
+import srmlist
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='staging-test-')
+        self.journal = os.path.join(self.dir, 'journal.db')
+        self.srmlist = os.path.join(self.dir, 'files')
+        f = open(self.srmlist, 'w')
+        for n in range(50):
+            f.write('srm://srm.example.org:8443/pnfs/example.org/data/test/file%03d\n' % n)
+        f.close()
+        self.env = dict(os.environ, STAGING_BACKEND='fake', STAGING_JOURNAL=self.journal,
+                        FAKE_LATENCY='0', FAKE_ONLINE_RATE='0', FAKE_FAILURE_RATE='0',
+                        FAKE_RECALL_TIME='0', FAKE_BUSY_RATE='0')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_script(self, script, *args, **env):
+        """Run a script, and return its exit status, stdout and stderr. A
+        script that runs longer than a minute is killed."""
+        p = subprocess.Popen([sys.executable, os.path.join(here, script)] + list(args),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             env=dict(self.env, **env), cwd=self.dir)
+        timer = threading.Timer(60, p.kill)
+        timer.start()
+        try:
+            (stdout, stderr) = p.communicate()
+        finally:
+            timer.cancel()
+        return (p.returncode, stdout, stderr)
+
+    def stage(self, chunksize=10):
+        (status, stdout, stderr) = self.run_script('stage.py', '--file', self.srmlist,
+                                                   '--chunksize', str(chunksize))
+        self.assertEqual(status, 0, stderr)
+        return int(stdout.splitlines()[0].split()[-1])
+
+    def counts(self, job):
+        jrnl = journal.Journal(self.journal)
+        try:
+            return jrnl.counts(job)
+        finally:
+            jrnl.close()
+
+    def set_token(self, job, chunk, token):
+        db = sqlite3.connect(self.journal)
+        old = db.execute('select token from tokens where job = ? and chunk = ?',
+                         (job, chunk)).fetchone()[0]
+        db.execute('update tokens set token = ? where job = ? and chunk = ?', (token, job, chunk))
+        db.commit()
+        db.close()
+        return old
+
+    def test_release_job_resume(self):
+        job = self.stage()
+        token = self.set_token(job, 0, 'fake:bogus')
+
+        (status, stdout, stderr) = self.run_script('release.py', '--job', str(job))
+        self.assertEqual(status, 2)
+        self.assertIn('10 files could not be released', stderr)
+        self.assertEqual(stdout.count(' UNPINNED'), 40)
+        self.assertEqual(self.counts(job), {journal.QUEUED: 10, journal.RELEASED: 40})
+
+        # A rerun only releases the files that were not released before.
+        self.set_token(job, 0, token)
+        (status, stdout, stderr) = self.run_script('release.py', '--job', str(job))
+        self.assertEqual(status, 0, stderr)
+        self.assertEqual(stdout.count(' UNPINNED'), 10)
+        self.assertEqual(self.counts(job), {journal.RELEASED: 50})
+
+        (status, stdout, stderr) = self.run_script('release.py', '--job', str(job))
+        self.assertEqual(status, 0, stderr)
+        self.assertEqual(stdout.count(' UNPINNED'), 0)
+
+    def test_release_job_without_token(self):
+        job = self.stage()
+        self.set_token(job, 1, None)
+        (status, stdout, stderr) = self.run_script('release.py', '--job', str(job))
+        self.assertEqual(status, 0, stderr)
+        self.assertIn('Chunk 1 has no token, not released: 10 QUEUED', stderr)
+        self.assertEqual(stdout.count(' UNPINNED'), 40)
+
+    def test_cleanup_rerun_without_token(self):
+        self.stage()
+        # A rerun of files that are online returns no token.
+        (status, stdout, stderr) = self.run_script('stage.py', '--file', self.srmlist,
+                                                   '--chunksize', '10', FAKE_ONLINE_RATE='1')
+        self.assertEqual(status, 0, stderr)
+        (status, stdout, stderr) = self.run_script('cleanup.py', '--file', self.srmlist)
+        self.assertEqual(status, 2)
+        self.assertEqual(stdout.count('MAY STILL BE PINNED, no token'), 50)
+        self.assertIn('No token: 50 files may still be pinned', stdout)
+        self.assertEqual(stdout.count('10 released, 0 still pinned'), 5)
+
+    def test_wait_job(self):
+        job = self.stage()
+        (status, stdout, stderr) = self.run_script('state.py', '--job', str(job), '--wait')
+        self.assertEqual(status, 0, stderr)
+        self.assertEqual(self.counts(job), {journal.READY: 50})
+
+        # Nothing is left to poll, so a busy SRM does not matter anymore.
+        (status, stdout, stderr) = self.run_script('state.py', '--job', str(job), '--wait',
+                                                   '--max-failures', '1', FAKE_BUSY_RATE='1')
+        self.assertEqual(status, 0, stderr)
+
+    def test_wait_invalid_token(self):
+        start = time.time()
+        (status, stdout, stderr) = self.run_script('state.py', '--file', self.srmlist,
+                                                   '--token', 'fake:bogus', '--wait')
+        self.assertEqual(status, 2)
+        self.assertIn('Poll failed, giving up', stderr)
+        # EINVAL is not retried.
+        self.assertNotIn('will retry', stderr)
+        self.assertLess(time.time() - start, 10)
+
+    def test_wait_max_failures(self):
+        job = self.stage()
+        (status, stdout, stderr) = self.run_script('state.py', '--job', str(job), '--wait',
+                                                   '--max-failures', '2', FAKE_BUSY_RATE='1')
+        self.assertEqual(status, 2)
+        self.assertEqual(stderr.count('Poll failed, will retry'), 1)
+        self.assertIn('Poll failed, giving up', stderr)
+        self.assertEqual(self.counts(job), {journal.QUEUED: 50})
+
+    def test_wait_job_failed_token(self):
+        job = self.stage()
+        # Every poll fails at its second token, after the first token's
+        # files were updated.
+        (status, stdout, stderr) = self.run_script('state.py', '--job', str(job), '--wait',
+                                                   FAKE_BUSY_EVERY='2')
+        self.assertEqual(status, 0, stderr)
+        self.assertEqual(stderr.count('Poll failed, will retry'), 4)
+        self.assertIn('50/50 files done', stderr)
+        self.assertEqual(self.counts(job), {journal.READY: 50})
+
+
+class SrmlistTest(unittest.TestCase):
+
+    def gzip(self, data):
+        buf = io.BytesIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb')
+        f.write(data)
+        f.close()
+        return buf.getvalue()
+
+    def test_stdin(self):
+        data = 'srm://x/a\n# comment\n\nsrm://x/b'
+        lines = ['srm://x/a\n', '# comment\n', '\n', 'srm://x/b']
+        self.assertEqual(list(srmlist.Stdin(io.BytesIO(data), blocksize=3)), lines)
+        self.assertEqual(list(srmlist.Stdin(io.BytesIO(self.gzip(data)), blocksize=3)), lines)
+        self.assertEqual(list(srmlist.Stdin(io.BytesIO(''))), [])
+
+    def test_stdin_concatenated_gzip(self):
+        data = self.gzip('srm://x/a\n') + self.gzip('srm://x/b\n')
+        self.assertEqual(list(srmlist.Stdin(io.BytesIO(data), blocksize=5)),
+                         ['srm://x/a\n', 'srm://x/b\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Benchmark of the LSC checkers against the fake operations portal and
+# VOMS servers of fakevoms.py, to see how a full sweep scales with the
+# number of VOs before rolling the checkers out to all nodes.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os
+import re
+import sys
+import time
+import argparse
+import textwrap
+import tempfile
+import shutil
+import subprocess
+
+import fakevoms
+
+parser=argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+
+        This script will generate VO ID cards, LSC files and VOMS server
+        certificates for each number of VOs (see fakevoms.py), serve them
+        on local addresses with the given latency and failures, and run
+        the checkers against them.
+
+        Usage:
+        $ python benchmark.py --sizes 10,100,1000 --dead 1 --latency 0.05
+
+        Steps:
+        portal  - check_lsc.py: one request per VO ID card, nothing cached
+        bulk    - check_lsc.py --bulk: the ID cards of all VOs at once
+        cached  - check_lsc.py a second time, with the cache and state file
+                  of a first run
+        voms    - vomsserver.py --errors: against the VOMS servers
+
+        Script output:
+        For each number of VOs and step: the wall time, the number of VOs
+        per second, the peak memory use (RSS) of the checker, its exit
+        status, and the number of problems it reported and that were
+        generated. The voms step also reports the LSC files of dead VOMS
+        servers (as errors) and, with --voms-errors, the failed requests.
+        '''))
+
+parser.add_argument('--sizes', action="store", dest="sizes", default='10,100,1000',
+    help='Comma separated numbers of VOs. Default: 10,100,1000')
+
+parser.add_argument('--steps', action="store", dest="steps", default='portal,bulk,cached,voms',
+    help='Comma separated steps to run. Default: portal,bulk,cached,voms')
+
+parser.add_argument('--servers', action="store", dest="servers", type=int, default=5,
+    help='Number of VOMS servers. Default: 5.')
+
+parser.add_argument('--workers', action="store", dest="workers", type=int, default=8,
+    help='--workers for check_lsc.py. Default: 8.')
+
+parser.add_argument('--voms-workers', action="store", dest="voms_workers", type=int, default=16,
+    help='--workers for vomsserver.py. Default: 16.')
+
+parser.add_argument('--latency', action="store", dest="latency", type=float, default=0.05,
+    help='Seconds before the portal answers. Default: 0.05.')
+
+parser.add_argument('--voms-latency', action="store", dest="voms_latency", type=float, default=0.05,
+    help='Seconds before a VOMS server answers. Default: 0.05.')
+
+parser.add_argument('--mismatch', action="store", dest="mismatch", type=float, default=0.01,
+    help='Fraction of the LSC files with a wrong DN. Default: 0.01.')
+
+parser.add_argument('--missing', action="store", dest="missing", type=float, default=0.01,
+    help='Fraction of the LSC files that is missing. Default: 0.01.')
+
+parser.add_argument('--dead', action="store", dest="dead", type=int, default=1,
+    help='Number of VOMS servers that does not run. Default: 1.')
+
+parser.add_argument('--errors', action="store", dest="errors", type=float, default=0.0,
+    help='Fraction of the portal requests that fails. Default: 0.')
+
+parser.add_argument('--voms-errors', action="store", dest="voms_errors", type=float, default=0.0,
+    help='Fraction of the VOMS server requests that fails. Default: 0.')
+
+parser.add_argument('--portal-port', action="store", dest="portal_port", type=int, default=18081,
+    help='Port for the fake portal. Default: 18081.')
+
+parser.add_argument('--voms-port', action="store", dest="voms_port", type=int, default=18443,
+    help='Port for the fake VOMS servers. Default: 18443.')
+
+parser.add_argument('--keep', action="store_true", dest="keep", default=False,
+    help='Keep the generated fixtures.')
+
+args=parser.parse_args()
+
+if args.dead>args.servers:
+    parser.error('--dead can not be more than --servers')
+
+here=os.path.dirname(os.path.abspath(__file__))
+problems=re.compile(r'^(discrepancy|missing|=== )',re.M)
+
+def run(step, size, expected, env, command):
+    """Run a checker and report its wall time and peak RSS."""
+    out=tempfile.TemporaryFile()
+    start=time.time()
+    p=subprocess.Popen([sys.executable, os.path.join(here, command[0])] + command[1:],
+                       stdout=out, stderr=subprocess.STDOUT, env=env)
+    (_, status, usage)=os.wait4(p.pid, 0)
+    elapsed=time.time()-start
+    out.seek(0)
+    output=out.read().decode('utf-8','replace')
+    print('%-8s %7d %9.2f %9.1f %10.1f %4d %9d %9d' % (step, size, elapsed, size/elapsed,
+                                                     usage.ru_maxrss/1024.0, os.WEXITSTATUS(status),
+                                                     len(problems.findall(output)), expected))
+    sys.stdout.flush()
+    return output
+
+steps=args.steps.split(',')
+workdir=tempfile.mkdtemp(prefix='voms-benchmark-')
+print('%-8s %7s %9s %9s %10s %4s %9s %9s' % ('step', 'VOs', 'seconds', 'VOs/s', 'RSS (MB)', 'exit',
+                                             'reported', 'expected'))
+
+try:
+    for size in [int(size) for size in args.sizes.split(',')]:
+        directory=os.path.join(workdir, 'vos%d' % size)
+        fixture=fakevoms.generate(directory, size, args.servers, args.mismatch, args.missing, args.dead)
+        servers=fakevoms.serve(directory, args.portal_port, args.voms_port, args.latency,
+                               args.voms_latency, args.errors, args.voms_errors)
+        env=dict(os.environ)
+        env.update(fakevoms.environment(directory, args.portal_port, args.voms_port))
+        portal_problems=fixture['expected']['mismatch']+fixture['expected']['missing']
+        # LSC files of a dead VOMS server can only be reported as errors.
+        voms_problems=0
+        for vo in fixture['vos']:
+            d=os.path.join(directory, 'vomsdir', vo)
+            for name in os.listdir(d):
+                f=open(os.path.join(d, name))
+                wrong='wrong' in f.readline()
+                f.close()
+                if wrong or name[:-len('.lsc')] in fixture['dead']:
+                    voms_problems+=1
+        try:
+            common=['--workers', str(args.workers)]
+            if 'portal' in steps:
+                run('portal', size, portal_problems, env, ['check_lsc.py', '--no-cache', '--no-state'] + common)
+            if 'bulk' in steps:
+                run('bulk', size, portal_problems, env, ['check_lsc.py', '--bulk', '--no-cache', '--no-state'] + common)
+            if 'cached' in steps:
+                subprocess.call([sys.executable, os.path.join(here, 'check_lsc.py')] + common,
+                                stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT, env=env)
+                run('cached', size, portal_problems, env, ['check_lsc.py'] + common)
+            if 'voms' in steps:
+                run('voms', size, voms_problems, env, ['vomsserver.py', '--errors', '--workers',
+                                                       str(args.voms_workers), '--timeout', '3600'])
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+finally:
+    if args.keep:
+        print('Fixtures kept in %s' % workdir)
+    else:
+        shutil.rmtree(workdir)
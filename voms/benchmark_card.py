@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Benchmark of lsc.parse_card against the minidom parser it replaced, on
+# generated VO ID cards of growing size.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os
+import sys
+import time
+import json
+import hashlib
+import argparse
+import textwrap
+import tempfile
+import shutil
+import subprocess
+from xml.dom import minidom
+
+import lsc
+
+parser=argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+
+        This script will generate VO ID cards with the given numbers of
+        contacts and a tenth as many VOMS servers, and parse each of them
+        in a separate process with the old minidom parser and with
+        lsc.parse_card.
+
+        Usage:
+        $ python benchmark_card.py --sizes 1000,10000,100000
+
+        Script output:
+        For each card and parser: the size of the card, the parse time,
+        the peak memory use (RSS) of the process, and a hash of the result,
+        which must be the same for both parsers.
+        '''))
+
+parser.add_argument('--sizes', action="store", dest="sizes", default='1000,10000,100000',
+    help='Comma separated numbers of contacts in the cards. Default: 1000,10000,100000')
+
+parser.add_argument('--repeat', action="store", dest="repeat", type=int, default=3,
+    help='Number of times each card is parsed; the fastest time is reported. Default: 3.')
+
+parser.add_argument('--keep', action="store_true", dest="keep", default=False,
+    help='Keep the generated cards.')
+
+parser.add_argument('--parse', action="store", dest="parse", nargs=2, metavar=('PARSER', 'CARD'),
+    help=argparse.SUPPRESS)
+
+args=parser.parse_args()
+
+def parse_card_minidom(text):
+    """lsc.parse_card as it was, on a full minidom tree."""
+
+    try:
+        xmldoc = minidom.parseString(text)
+    except:
+        return None
+    voms_servers  = xmldoc.getElementsByTagName('VOMS_Server')
+
+    lscs={}
+    for voms_server in voms_servers:
+
+        hostname  = voms_server.getElementsByTagName('hostname')[0]
+        lsc_file_name= hostname.firstChild.nodeValue+'.lsc'
+
+        X509  = voms_server.getElementsByTagName('X509Cert')[0]
+        DN=X509.getElementsByTagName('DN')[0].firstChild.nodeValue
+        CA_DN=X509.getElementsByTagName('CA_DN')[0].firstChild.nodeValue
+
+        lscs.update({lsc_file_name: {'DN':DN, 'CA_DN':CA_DN} })
+
+    return lscs
+
+def generate(path, contacts):
+    f=open(path, 'w')
+    f.write('<?xml version="1.0" encoding="UTF-8"?><VoDump>'
+            '<IDCard Name="bench.example.org" Status="Production">'
+            '<Description>Generated by benchmark_card.py</Description><Contacts>')
+    for n in range(contacts):
+        f.write('<Contact><Name>Contact %d</Name><Email>contact%d@example.org</Email>'
+                '<Role>VO Manager</Role><DN>/DC=org/DC=example/CN=Contact %d</DN></Contact>' % (n, n, n))
+    f.write('</Contacts><VOMS_Servers>')
+    for n in range(max(1, contacts//10)):
+        f.write('<VOMS_Server HttpsPort="8443" VomsesPort="15000"><hostname>voms%d.example.org</hostname>'
+                '<X509Cert><DN>/DC=org/DC=example/CN=voms%d.example.org</DN>'
+                '<CA_DN>/DC=org/DC=example/CN=Example CA</CA_DN></X509Cert></VOMS_Server>' % (n, n))
+    f.write('</VOMS_Servers></IDCard></VoDump>')
+    f.close()
+
+if args.parse:
+    # In a child process, so that the peak RSS is that of one parser only.
+    (name, path)=args.parse
+    f=open(path, 'rb')
+    content=f.read()
+    f.close()
+    if name=='minidom':
+        # parse_card used to get the decoded text of the response.
+        (parse, data)=(parse_card_minidom, content.decode('utf-8'))
+    else:
+        (parse, data)=(lsc.parse_card, content)
+    best=None
+    for n in range(args.repeat):
+        start=time.time()
+        result=parse(data)
+        elapsed=time.time()-start
+        best=elapsed if best is None else min(best, elapsed)
+    digest=hashlib.sha256(json.dumps(result, sort_keys=True).encode('utf-8')).hexdigest()
+    print('%f %s' % (best, digest))
+    sys.exit(0)
+
+def run(name, path):
+    out=tempfile.TemporaryFile()
+    p=subprocess.Popen([sys.executable, os.path.abspath(__file__), '--repeat', str(args.repeat),
+                        '--parse', name, path], stdout=out)
+    (_, status, usage)=os.wait4(p.pid, 0)
+    out.seek(0)
+    (elapsed, digest)=out.read().decode('ascii').split()
+    return (float(elapsed), usage.ru_maxrss/1024.0, digest)
+
+workdir=tempfile.mkdtemp(prefix='card-benchmark-')
+print('%-10s %9s %9s %9s %10s %s' % ('parser', 'contacts', 'MB', 'seconds', 'RSS (MB)', 'result'))
+
+try:
+    for size in [int(size) for size in args.sizes.split(',')]:
+        path=os.path.join(workdir, 'card%d.xml' % size)
+        generate(path, size)
+        megabytes=os.path.getsize(path)/1048576.0
+        for name in ('minidom', 'parse_card'):
+            (elapsed, rss, digest)=run(name, path)
+            print('%-10s %9d %9.1f %9.3f %10.1f %s' % (name, size, megabytes, elapsed, rss, digest[:12]))
+            sys.stdout.flush()
+finally:
+    if args.keep:
+        print('Cards kept in %s' % workdir)
+    else:
+        shutil.rmtree(workdir)
@@ -1,51 +1,106 @@
 #!/usr/bin/env python
 
 import lsc
-import os,sys,string,hashlib
+import os,sys
+import argparse
+from multiprocessing.pool import ThreadPool
 
-vomsdir='/etc/grid-security/vomsdir'
+vomsdir=lsc.vomsdir
+state_file=os.path.join(lsc.cache_dir,'check_lsc.state')
+
+parser=argparse.ArgumentParser(
+    description='Check whether the LSC files in '+vomsdir+' match the VO ID cards in the operations portal.')
+parser.add_argument('--workers', action='store', dest='workers', type=int, default=8,
+    help='Number of VO ID cards to fetch in parallel. Default: 8.')
+parser.add_argument('--bulk', action='store_true', dest='bulk', default=False,
+    help='Download the ID cards of all VOs at once instead of one request per VO.')
+parser.add_argument('--cache-dir', action='store', dest='cache_dir', default=lsc.cache_dir,
+    help='Directory to cache the VO ID cards in. Default: '+lsc.cache_dir)
+parser.add_argument('--ttl', action='store', dest='ttl', type=int, default=3600,
+    help='Seconds to use cached VO ID cards without asking the portal whether they changed. Default: 3600.')
+parser.add_argument('--refresh', action='store_true', dest='refresh', default=False,
+    help='Download all VO ID cards again, ignoring the cache.')
+parser.add_argument('--no-cache', action='store_true', dest='no_cache', default=False,
+    help='Do not use or write the cache.')
+parser.add_argument('--state', action='store', dest='state', default=state_file,
+    help='File to remember the hashes of the LSC files and the results of the last run in, so that only '
+         'LSC files and VO ID cards that changed are compared again. Default: '+state_file)
+parser.add_argument('--no-state', action='store_true', dest='no_state', default=False,
+    help='Read and compare all LSC files, without using or writing the state file.')
+parser.add_argument('--verbose', action='store_true', dest='verbose', default=False,
+    help='Report on stderr how many LSC files were read and compared again instead of taken from the state.')
+args=parser.parse_args()
+
+if args.workers<1:
+    parser.error('--workers must be at least 1')
 
 try:
-    vos=os.listdir(vomsdir)
+    vos=sorted(os.listdir(vomsdir))
 except:
     e=sys.exc_info()[1]
     sys.stderr.write(str(e)+'\n')
     sys.exit(1)
 
-for vo in vos:
-    r=lsc.get_lsc_info(vo)
+# One keep-alive session for all VOs.
+session=lsc.new_session(args.workers)
+
+state=None
+if not args.no_state:
+    state=lsc.State(args.state)
+
+cache=None
+if not args.no_cache:
+    try:
+        cache=lsc.Cache(args.cache_dir,args.ttl,args.refresh)
+    except OSError:
+        e=sys.exc_info()[1]
+        sys.stderr.write('Not using the cache: '+str(e)+'\n')
+
+index=None
+if args.bulk:
+    try:
+        index=lsc.fetch_index(session,cache)
+    except lsc.LSCError:
+        e=sys.exc_info()[1]
+        sys.stderr.write(str(e)+'\n')
+        sys.exit(1)
+
+def fetch(vo):
+    if index is not None:
+        return (vo, lsc.get_lsc_info(vo,index=index), None)
+    try:
+        return (vo, lsc.fetch_lsc_info(vo,session,cache), None)
+    except lsc.LSCError:
+        return (vo, None, sys.exc_info()[1])
+
+pool=ThreadPool(args.workers)
+
+# The VO ID cards are fetched in parallel, but handled in the order of the VOs.
+for vo,r,error in pool.imap(fetch, vos):
+    if error:
+        sys.stderr.write(str(error)+'\n')
+        sys.exit(1)
     if r==None or r=={}: continue
 
-    voms_servers=r.keys()
-    for voms_server in voms_servers:
-        lsc_path=vomsdir+'/'+vo+'/'+voms_server.encode('ascii')
-        if os.path.isfile(lsc_path):
-
-            f=open(lsc_path,'r')
-            textlist=map(string.strip,f.readlines())
-            f.close()
-            
-            text=''.join(textlist)
-            hash_file=hashlib.sha256(text).hexdigest()
-
-            textlist=[ r[voms_server]['DN'], r[voms_server]['CA_DN'] ]
-            text=''.join(textlist)
-            hash_portal=hashlib.sha256(text).hexdigest()
-
-            if hash_portal!=hash_file:
-                
-                print ('discrepancy')
-                print (vo)
-                print (lsc_path)
-                print (r[voms_server]['DN'])
-                print (r[voms_server]['CA_DN'])
-                print ('\n')
-
-        else:
-
-            print ('missing')
-            print (vo)
-            print (lsc_path)
-            print (r[voms_server]['DN'])
-            print (r[voms_server]['CA_DN'])
-            print ('\n')
+    for status,voms_server,lsc_path in lsc.compare(vomsdir,vo,r,state):
+        if status=='ok': continue
+
+        print (status)
+        print (vo)
+        print (lsc_path)
+        print (r[voms_server]['DN'])
+        print (r[voms_server]['CA_DN'])
+        print ('\n')
+
+pool.close()
+pool.join()
+
+if state is not None:
+    if args.verbose:
+        sys.stderr.write('State: %d LSC files checked, %d read again, %d compared again\n'%
+                         (len(state.seen),state.rehashed,state.rechecked))
+    try:
+        state.save()
+    except (IOError,OSError):
+        e=sys.exc_info()[1]
+        sys.stderr.write('Could not save the state: '+str(e)+'\n')
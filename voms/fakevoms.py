@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+# A simulated operations portal and VOMS servers, to run the LSC checkers
+# (check_lsc.py, vomsserver.py, fleet_lsc.py, lsc_monitor.py) against
+# without touching the real ones. Used by benchmark.py.
+#
+# generate() writes a fixture to a directory: VO ID cards, a vomsdir with
+# the matching LSC files, a CA and a certificate for every VOMS server and
+# a client certificate. serve() starts the portal and the VOMS servers for
+# it in threads. Every VOMS server listens on its own loopback address
+# (127.0.0.2, 127.0.0.3, ...), which is also its host name in the ID cards
+# and the LSC files, all on the same port. environment() gives the
+# environment variables that point the checkers at them.
+#
+# Usage:
+# $ python fakevoms.py [directory] --vos 100 --servers 5
+# generates a fixture (unless [directory] already has one), serves it and
+# prints the environment variables to use, until interrupted.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import os,sys,time,random,json,ssl,socket,subprocess,threading
+import argparse
+import textwrap
+try:
+    from BaseHTTPServer import HTTPServer,BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer,BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+card_path='/xml/voIDCard/public/voname/'
+all_path='/xml/voIDCard/public/all/true'
+ca_dn='/DC=org/DC=example/CN=Fake VOMS CA'
+
+def openssl(*args):
+    devnull=open(os.devnull,'w')
+    try:
+        subprocess.check_call(('openssl',)+args,stdout=devnull,stderr=devnull)
+    finally:
+        devnull.close()
+
+def make_certificate(directory,name,dn,address=None):
+    """Write name.key and name.pem, a certificate for dn signed by the CA
+    in directory, valid for the IP address."""
+    key=os.path.join(directory,name+'.key')
+    csr=os.path.join(directory,name+'.csr')
+    pem=os.path.join(directory,name+'.pem')
+    openssl('req','-new','-newkey','rsa:2048','-nodes','-keyout',key,'-out',csr,'-subj',dn)
+    extensions=os.path.join(directory,name+'.ext')
+    f=open(extensions,'w')
+    if address:
+        # Also as DNS name: without the ipaddress module, urllib3 on
+        # Python 2 does not match IP addresses.
+        f.write('subjectAltName=IP:%s,DNS:%s\n' % (address,address))
+    f.close()
+    openssl('x509','-req','-in',csr,'-CA',os.path.join(directory,'ca.pem'),
+            '-CAkey',os.path.join(directory,'ca.key'),'-CAcreateserial',
+            '-days','30','-extfile',extensions,'-out',pem)
+    os.remove(csr)
+    os.remove(extensions)
+    return (pem,key)
+
+def server_dn(host):
+    return '/DC=org/DC=example/CN=voms-%s' % host
+
+def card(vo,hosts,dns):
+    """The XML of a VO ID card, without the XML declaration."""
+    servers=''.join('<VOMS_Server HttpsPort="8443" VomsesPort="15000"><hostname>%s</hostname>'
+                    '<X509Cert><DN>%s</DN><CA_DN>%s</CA_DN></X509Cert></VOMS_Server>' % (host,dns[host],ca_dn)
+                    for host in hosts)
+    return '<IDCard Name="%s"><VOMS_Servers>%s</VOMS_Servers></IDCard>' % (vo,servers)
+
+def generate(directory,vos=100,servers=5,mismatch=0.0,missing=0.0,dead=0,seed=0):
+    """Write a fixture for vos VOs, each with two of the VOMS servers.
+    A fraction mismatch of the LSC files has a wrong DN, a fraction
+    missing is not there, and the last dead VOMS servers are in the ID
+    cards but are not started by serve()."""
+    rng=random.Random(seed)
+    certificates=os.path.join(directory,'certificates')
+    portal=os.path.join(directory,'portal')
+    vomsdir=os.path.join(directory,'vomsdir')
+    for d in (certificates,portal,vomsdir):
+        os.makedirs(d)
+
+    openssl('req','-x509','-new','-newkey','rsa:2048','-nodes','-days','30','-subj',ca_dn,
+            '-keyout',os.path.join(certificates,'ca.key'),'-out',os.path.join(certificates,'ca.pem'))
+    # The CA directory is used as X509_CERT_DIR, which needs the hash link.
+    ca_hash=subprocess.Popen(['openssl','x509','-hash','-noout','-in',os.path.join(certificates,'ca.pem')],
+                             stdout=subprocess.PIPE).communicate()[0].decode('ascii').strip()
+    os.symlink('ca.pem',os.path.join(certificates,ca_hash+'.0'))
+    make_certificate(certificates,'client','/DC=org/DC=example/CN=client')
+
+    hosts=['127.0.0.%d' % (n+2) for n in range(servers)]
+    dns=dict((host,server_dn(host)) for host in hosts)
+    for host in hosts[:servers-dead]:
+        make_certificate(certificates,host,dns[host],host)
+
+    names=['vo%05d' % n for n in range(vos)]
+    expected={'mismatch':0,'missing':0}
+    export=open(os.path.join(portal,'all'),'w')
+    export.write('<?xml version="1.0"?><VoDump>')
+    for vo in names:
+        vo_hosts=sorted(rng.sample(hosts,min(2,servers)))
+        text=card(vo,vo_hosts,dns)
+        export.write(text)
+        f=open(os.path.join(portal,vo),'w')
+        f.write('<?xml version="1.0"?><VoDump>%s</VoDump>' % text)
+        f.close()
+        os.mkdir(os.path.join(vomsdir,vo))
+        for host in vo_hosts:
+            draw=rng.random()
+            if draw<missing:
+                expected['missing']+=1
+                continue
+            dn=dns[host]
+            if draw<missing+mismatch:
+                expected['mismatch']+=1
+                dn=dn+' wrong'
+            f=open(os.path.join(vomsdir,vo,host+'.lsc'),'w')
+            f.write('%s\n%s\n' % (dn,ca_dn))
+            f.close()
+    export.write('</VoDump>')
+    export.close()
+
+    fixture={'vos':names,'hosts':hosts,'dead':hosts[servers-dead:],'expected':expected}
+    f=open(os.path.join(directory,'fixture.json'),'w')
+    json.dump(fixture,f)
+    f.close()
+    return fixture
+
+def load(directory):
+    f=open(os.path.join(directory,'fixture.json'),'r')
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+class Server(ThreadingMixIn,HTTPServer):
+    daemon_threads=True
+    # The checkers open many connections at once.
+    request_queue_size=128
+
+    def handle_error(self,request,client_address):
+        # vomsserver.peer_certificate hangs up right after the handshake.
+        if not isinstance(sys.exc_info()[1],(ssl.SSLError,socket.error)):
+            HTTPServer.handle_error(self,request,client_address)
+
+class PortalHandler(BaseHTTPRequestHandler):
+    """Serves the ID cards, after server.latency seconds. A fraction
+    server.errors of the requests fails with 503."""
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if random.random()<self.server.errors:
+            self.send_error(503)
+            return
+        if self.path==all_path:
+            name='all'
+        elif self.path.startswith(card_path):
+            name=self.path[len(card_path):]
+        else:
+            name=None
+        path=os.path.join(self.server.directory,'portal',name or '')
+        if not name or '/' in name or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        f=open(path,'rb')
+        body=f.read()
+        f.close()
+        self.send_response(200)
+        self.send_header('Content-Type','text/xml')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+class VOMSHandler(BaseHTTPRequestHandler):
+    """Serves the configuration page of every VO, with the VOMSES line that
+    vomsserver.parse_interface looks for, after server.latency seconds.
+    A fraction server.errors of the requests fails with 500."""
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if random.random()<self.server.errors:
+            self.send_error(500)
+            return
+        parts=self.path.split('/')
+        if len(parts)!=5 or parts[1]!='voms' or parts[3:]!=['configuration','configuration.action']:
+            self.send_error(404)
+            return
+        vo=parts[2]
+        (host,port)=self.server.server_address[:2]
+        body=textwrap.dedent('''\
+            <html><body>
+            <h3>VOMSES string for this VO</h3>
+            <div class="configurationInfo">&quot;%s&quot; &quot;%s&quot; &quot;%s&quot; &quot;%s&quot; &quot;%s&quot;</div>
+            </body></html>
+            ''') % (vo,host,port,server_dn(host),vo)
+        body=body.encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type','text/html')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+def start(server):
+    thread=threading.Thread(target=server.serve_forever)
+    thread.daemon=True
+    thread.start()
+    return server
+
+def serve(directory,portal_port=18081,voms_port=18443,latency=0.0,voms_latency=0.0,
+          errors=0.0,voms_errors=0.0):
+    """Start the portal on 127.0.0.1:portal_port and the VOMS servers that
+    are not dead on their own addresses and voms_port. Returns the servers,
+    to shutdown() when done."""
+    fixture=load(directory)
+    certificates=os.path.join(directory,'certificates')
+    servers=[]
+    portal=Server(('127.0.0.1',portal_port),PortalHandler)
+    (portal.directory,portal.latency,portal.errors)=(directory,latency,errors)
+    servers.append(start(portal))
+    for host in fixture['hosts']:
+        if host in fixture['dead']:
+            continue
+        server=Server((host,voms_port),VOMSHandler)
+        context=ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(os.path.join(certificates,host+'.pem'),os.path.join(certificates,host+'.key'))
+        # The handshake is done in the thread of the request, not in the
+        # thread that accepts the connections.
+        server.socket=context.wrap_socket(server.socket,server_side=True,do_handshake_on_connect=False)
+        (server.latency,server.errors)=(voms_latency,voms_errors)
+        servers.append(start(server))
+    return servers
+
+def environment(directory,portal_port=18081,voms_port=18443):
+    """The environment variables that point lsc.py and vomsserver.py at
+    the fixture and the servers of serve()."""
+    certificates=os.path.join(directory,'certificates')
+    return {'LSC_PORTAL':'http://127.0.0.1:%d' % portal_port,
+            'X509_VOMS_DIR':os.path.join(directory,'vomsdir'),
+            'X509_CERT_DIR':certificates,
+            'X509_USER_CERT':os.path.join(certificates,'client.pem'),
+            'X509_USER_KEY':os.path.join(certificates,'client.key'),
+            'VOMS_PORT':str(voms_port),
+            'LSC_CACHE':os.path.join(directory,'cache')}
+
+def main():
+    parser=argparse.ArgumentParser(
+        description='Serve a fake operations portal and fake VOMS servers for the LSC checkers.')
+    parser.add_argument('directory',
+        help='Directory with the fixture. It is generated first when it has no fixture.json.')
+    parser.add_argument('--vos',action='store',type=int,default=100,
+        help='Number of VOs to generate. Default: 100.')
+    parser.add_argument('--servers',action='store',type=int,default=5,
+        help='Number of VOMS servers to generate. Default: 5.')
+    parser.add_argument('--mismatch',action='store',type=float,default=0.01,
+        help='Fraction of the LSC files with a wrong DN. Default: 0.01.')
+    parser.add_argument('--missing',action='store',type=float,default=0.01,
+        help='Fraction of the LSC files that is missing. Default: 0.01.')
+    parser.add_argument('--dead',action='store',type=int,default=0,
+        help='Number of VOMS servers that is not started. Default: 0.')
+    parser.add_argument('--portal-port',action='store',dest='portal_port',type=int,default=18081,
+        help='Port of the portal. Default: 18081.')
+    parser.add_argument('--voms-port',action='store',dest='voms_port',type=int,default=18443,
+        help='Port of the VOMS servers. Default: 18443.')
+    parser.add_argument('--latency',action='store',type=float,default=0.05,
+        help='Seconds before the portal answers. Default: 0.05.')
+    parser.add_argument('--voms-latency',action='store',dest='voms_latency',type=float,default=0.05,
+        help='Seconds before a VOMS server answers. Default: 0.05.')
+    parser.add_argument('--errors',action='store',type=float,default=0.0,
+        help='Fraction of the portal requests that fails. Default: 0.')
+    parser.add_argument('--voms-errors',action='store',dest='voms_errors',type=float,default=0.0,
+        help='Fraction of the VOMS server requests that fails. Default: 0.')
+    args=parser.parse_args()
+    if args.dead>args.servers:
+        parser.error('--dead can not be more than --servers')
+
+    if not os.path.exists(os.path.join(args.directory,'fixture.json')):
+        generate(args.directory,args.vos,args.servers,args.mismatch,args.missing,args.dead)
+    serve(args.directory,args.portal_port,args.voms_port,args.latency,args.voms_latency,
+          args.errors,args.voms_errors)
+    for (name,value) in sorted(environment(args.directory,args.portal_port,args.voms_port).items()):
+        print('export %s=%s' % (name,value))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# Check the LSC files of many hosts at once, from copies of their vomsdir
+# (for example rsync snapshots). Hosts mostly have the same LSC files, so
+# every distinct LSC file is checked only once, however many hosts have it.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import lsc
+import vomsserver
+import os,sys,time
+import argparse
+import textwrap
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+parser=argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+
+        Checks the LSC files in copies of the vomsdir of many hosts against
+        the VO ID cards in the operations portal, and optionally against
+        the VOMS servers themselves. Each VO ID card is fetched once for
+        all hosts and each distinct LSC file (same VO, same name, same
+        contents) is checked once, so the cost grows with the number of
+        distinct LSC files, not with the number of hosts.
+
+        Usage:
+        $ python fleet_lsc.py [host=]vomsdir [[host=]vomsdir ...]
+        For example:
+        $ python fleet_lsc.py wn1=/snapshots/wn1/etc/grid-security/vomsdir \\
+                              wn2=/snapshots/wn2/etc/grid-security/vomsdir
+        Without host=, the directory itself is used as the name of the host.
+
+        Script output:
+        One report per host, in the order given:
+        "### [host] [vomsdir]: [n] LSC files"
+        followed by the "discrepancy" and "missing" blocks of check_lsc.py
+        and, with --voms, the mismatches of vomsserver.py. A host without
+        findings gets "OK".
+        '''))
+parser.add_argument('roots', metavar='[HOST=]VOMSDIR', nargs='+',
+    help='Copy of the vomsdir of a host.')
+parser.add_argument('--workers', action='store', dest='workers', type=int, default=8,
+    help='Number of VO ID cards to fetch in parallel. Default: 8.')
+parser.add_argument('--bulk', action='store_true', dest='bulk', default=False,
+    help='Download the ID cards of all VOs at once instead of one request per VO.')
+parser.add_argument('--cache-dir', action='store', dest='cache_dir', default=lsc.cache_dir,
+    help='Directory to cache the VO ID cards in. Default: '+lsc.cache_dir)
+parser.add_argument('--ttl', action='store', dest='ttl', type=int, default=3600,
+    help='Seconds to use cached VO ID cards without asking the portal whether they changed. Default: 3600.')
+parser.add_argument('--refresh', action='store_true', dest='refresh', default=False,
+    help='Download all VO ID cards again, ignoring the cache.')
+parser.add_argument('--no-cache', action='store_true', dest='no_cache', default=False,
+    help='Do not use or write the cache.')
+parser.add_argument('--voms', action='store_true', dest='voms', default=False,
+    help='Also check the LSC files against the VOMS servers, like vomsserver.py.')
+parser.add_argument('--errors', action='store_true', dest='errors', default=False,
+    help='With --voms, also show VOMS server errors. Default: show only mismatches.')
+parser.add_argument('--voms-workers', action='store', dest='voms_workers', type=int, default=16,
+    help='Number of LSC files to check against the VOMS servers in parallel. Default: 16.')
+parser.add_argument('--timeout', action='store', dest='timeout', type=int, default=300,
+    help='Maximum number of seconds for the checks against the VOMS servers. Default: 300.')
+parser.add_argument('--cert-ttl', action='store', dest='cert_ttl', type=int, default=0,
+    help='Reuse VOMS server certificates from earlier runs for this many seconds. Default: 0 (no reuse).')
+parser.add_argument('--cert-cache', action='store', dest='cert_cache', default=vomsserver.certificate_cache,
+    help='File to keep the VOMS server certificates in for --cert-ttl. Default: '+vomsserver.certificate_cache)
+args=parser.parse_args()
+
+if args.workers<1 or args.voms_workers<1:
+    parser.error('--workers and --voms-workers must be at least 1')
+
+hosts=[]
+for root in args.roots:
+    (host,sep,path)=root.partition('=')
+    if not sep:
+        (host,path)=(root,root)
+    if not os.path.isdir(path):
+        parser.error('%s is not a directory' % path)
+    hosts.append((host,path))
+
+def scan(path):
+    """Return {vo: {lsc_file_name: sha256}} for a vomsdir."""
+    vos={}
+    for vo in sorted(os.listdir(path)):
+        d=os.path.join(path,vo)
+        if not os.path.isdir(d):
+            continue
+        vos[vo]={}
+        for name in sorted(os.listdir(d)):
+            lsc_path=os.path.join(d,name)
+            if name.endswith('.lsc') and os.path.isfile(lsc_path):
+                vos[vo][name]=lsc.file_hash(lsc_path)
+    return vos
+
+# Hash all LSC files, and remember one path for every distinct file.
+scans=[]
+paths={}
+n_files=0
+for (host,path) in hosts:
+    vos=scan(path)
+    scans.append(vos)
+    for vo in vos:
+        for name,digest in vos[vo].items():
+            paths.setdefault((vo,name,digest),os.path.join(path,vo,name))
+            n_files+=1
+
+session=lsc.new_session(args.workers)
+
+cache=None
+if not args.no_cache:
+    try:
+        cache=lsc.Cache(args.cache_dir,args.ttl,args.refresh)
+    except OSError:
+        e=sys.exc_info()[1]
+        sys.stderr.write('Not using the cache: '+str(e)+'\n')
+
+index=None
+if args.bulk:
+    try:
+        index=lsc.fetch_index(session,cache)
+    except lsc.LSCError:
+        e=sys.exc_info()[1]
+        sys.stderr.write(str(e)+'\n')
+        sys.exit(1)
+
+def fetch(vo):
+    if index is not None:
+        return (vo, lsc.get_lsc_info(vo,index=index), None)
+    try:
+        return (vo, lsc.fetch_lsc_info(vo,session,cache), None)
+    except lsc.LSCError:
+        return (vo, None, sys.exc_info()[1])
+
+# Start the checks against the VOMS servers first, they take longest.
+voms_results={}
+if args.voms:
+    deadline=time.time()+args.timeout
+    cert_cache=vomsserver.CertificateCache(args.cert_cache,args.cert_ttl) if args.cert_ttl>0 else None
+    vomsserver.check_capath()
+    checker=vomsserver.Checker(vomsserver.client_certificate(),args.voms_workers,False,cert_cache)
+    voms_pool=ThreadPool(args.voms_workers)
+    for key in sorted(paths):
+        voms_results[key]=voms_pool.apply_async(checker.check,(key[0],paths[key]))
+
+all_vos=sorted(set(vo for vos in scans for vo in vos))
+pool=ThreadPool(args.workers)
+cards={}
+for vo,r,error in pool.imap(fetch, all_vos):
+    if error:
+        sys.stderr.write(str(error)+'\n')
+        sys.exit(1)
+    cards[vo]=r
+pool.close()
+pool.join()
+
+# What the portal expects, hashed once for all hosts.
+portal_hashes={}
+for vo in all_vos:
+    for voms_server,info in (cards[vo] or {}).items():
+        portal_hashes[(vo,voms_server.encode('ascii'))]=lsc.portal_hash(info)
+
+def voms_result(key):
+    result=voms_results[key]
+    if not hasattr(result,'get'):
+        return result
+    try:
+        result=result.get(max(0,deadline-time.time()))
+    except TimeoutError:
+        result=('error','%s Could not check %s: did not finish within %d seconds' % (vomsserver.icon_question,paths[key],args.timeout),None)
+    voms_results[key]=result
+    return result
+
+def block(kind,vo,lsc_path,info):
+    return [kind, vo, lsc_path, info['DN'], info['CA_DN'], '\n']
+
+for (host,path),vos in zip(hosts,scans):
+    lines=[]
+    for vo in sorted(vos):
+        r=cards[vo]
+        for voms_server in sorted(r or {}):
+            name=voms_server.encode('ascii')
+            lsc_path=os.path.join(path,vo,name)
+            if name not in vos[vo]:
+                lines.extend(block('missing',vo,lsc_path,r[voms_server]))
+            elif vos[vo][name]!=portal_hashes[(vo,name)]:
+                lines.extend(block('discrepancy',vo,lsc_path,r[voms_server]))
+        if not args.voms:
+            continue
+        for name in sorted(vos[vo]):
+            (status,message,details)=voms_result((vo,name,vos[vo][name]))
+            if status=='ok' or (status!='mismatch' and not args.errors):
+                continue
+            lines.append('=== %s/%s => %s' % (vo,name,message))
+            if details:
+                # The details name the file that was checked, which may be
+                # the copy of another host.
+                details=['== %s ==' % os.path.join(path,vo,name)]+details[1:]
+                lines.extend([('    ' if line.startswith('/') else '  ')+line for line in details])
+    print('### %s %s: %d LSC files' % (host,path,sum(len(names) for names in vos.values())))
+    # Printed one by one: the DNs from the portal are unicode, the icons
+    # of vomsserver.py are UTF-8 encoded.
+    for line in lines or ['OK']:
+        print(line)
+    print('')
+    sys.stdout.flush()
+
+if args.voms:
+    voms_pool.close()
+    if cert_cache:
+        cert_cache.save()
+
+sys.stderr.write('%d LSC files on %d hosts, %d distinct, %d VOs\n' % (n_files,len(hosts),len(paths),len(all_vos)))
@@ -1,46 +1,331 @@
 #!/usr/bin/env python
 
-from xml.dom import minidom
-import requests,sys
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+import requests,sys,os,io,time,json,string,hashlib
 
-url='http://operations-portal.egi.eu/xml/voIDCard/public/voname/'
+# The operations portal can be replaced, e.g. by the fake one of fakevoms.py.
+portal=os.environ.get('LSC_PORTAL', 'http://operations-portal.egi.eu')
+url=portal+'/xml/voIDCard/public/voname/'
+# Export of the ID cards of all VOs
+all_url=portal+'/xml/voIDCard/public/all/true'
 HTTPOK=200
+NOTMODIFIED=304
+timeout=60
+cache_dir=os.environ.get('LSC_CACHE', os.path.expanduser('~/.cache/lsc'))
+vomsdir=os.environ.get('X509_VOMS_DIR', '/etc/grid-security/vomsdir')
+
+class LSCError(Exception):
+    pass
 
 def usage():
     sys.stderr.write('lsc.py <VO>\n')
 
-def get_lsc_info(vo):
-
+def http_get(session,location,headers=None,stream=False):
     try:
-        r=requests.get(url+vo)
+        return session.get(location,headers=headers,timeout=timeout,stream=stream)
     except:
         e=sys.exc_info()[1]
-        sys.stderr.write(str(e)+'\n')
-        sys.exit(1)
+        raise LSCError(str(e))
 
-    if r.status_code!=HTTPOK:
-        sys.stderr.write('Unable to get information for VO: '+vo+'\n')
-        sys.exit(1)
+def new_session(workers=1):
+    """A keep-alive session for fetching many VO ID cards, with at most one
+    connection per worker."""
+    session=requests.Session()
+    adapter=requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def write_json(path,data):
+    # Write and rename, so that concurrent runs never see half a file.
+    tmp='%s.%d.tmp' % (path,os.getpid())
+    f=open(tmp,'w')
+    json.dump(data,f)
+    f.close()
+    os.rename(tmp,path)
+
+class Cache(object):
+    """On-disk cache of parsed portal responses, one JSON file per VO (and
+    one for the export of all VOs). Entries younger than ttl seconds are
+    used as they are. Older entries are revalidated with the ETag and
+    Last-Modified headers of the response they came from, so that an
+    unchanged VO ID card is not downloaded again. With refresh, the cache
+    is not read, only written."""
+
+    def __init__(self,directory=cache_dir,ttl=3600,refresh=False):
+        self.directory=directory
+        self.ttl=ttl
+        self.refresh=refresh
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self,key):
+        return os.path.join(self.directory,key.replace('/','_')+'.json')
+
+    def load(self,key):
+        try:
+            f=open(self.path(key),'r')
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError,ValueError):
+            return None
+
+    def save(self,key,entry):
+        write_json(self.path(key),entry)
+
+    def get(self,key,location,session,parse,stream=False):
+        """Return the parsed response for location, from the cache when
+        possible. parse turns a 200 response into the data to cache."""
+        now=time.time()
+        entry=None if self.refresh else self.load(key)
+        if entry and now-entry['fetched']<self.ttl:
+            return entry['data']
+
+        headers={}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match']=entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since']=entry['last_modified']
 
+        r=http_get(session,location,headers,stream)
+        if r.status_code==NOTMODIFIED and entry:
+            r.close()
+            entry['fetched']=now
+            self.save(key,entry)
+            return entry['data']
+        if r.status_code!=HTTPOK:
+            r.close()
+            raise LSCError('Unable to get '+location)
+
+        data=parse(r)
+        if data is not None:
+            self.save(key,{'fetched':now,
+                           'etag':r.headers.get('ETag'),
+                           'last_modified':r.headers.get('Last-Modified'),
+                           'data':data})
+        return data
+
+def voms_server_info(elem):
+    """Return (lsc_file_name, {'DN':..., 'CA_DN':...}) for a VOMS_Server
+    element, or None when it has no host name or certificate."""
+
+    hostname=elem.findtext('hostname')
+    X509=elem.find('X509Cert')
+    if not hostname or X509 is None:
+        return None
+    return (hostname+'.lsc', {'DN':X509.findtext('DN'), 'CA_DN':X509.findtext('CA_DN')})
+
+def parse_card(text):
+    """Return {lsc_file_name: {'DN':..., 'CA_DN':...}} from a VO ID card,
+    or None when it can't be parsed. The card is parsed incrementally and
+    every element is removed from the tree once it has been read (the
+    VOMS_Server elements once they have been read whole), so a big card
+    does not end up in memory as a tree."""
+
+    if not isinstance(text,bytes):
+        text=text.encode('utf-8')
+    lscs={}
+    inside=0
+    # The open elements, to remove an element from its parent once read.
+    parents=[]
     try:
-        xmldoc = minidom.parseString(r.text)
-    except:
+        for event,elem in ElementTree.iterparse(io.BytesIO(text), events=('start','end')):
+            if event=='start':
+                parents.append(elem)
+            else:
+                parents.pop()
+            if elem.tag=='VOMS_Server':
+                if event=='start':
+                    inside+=1
+                    continue
+                inside-=1
+                info=voms_server_info(elem)
+                if info:
+                    lscs.update([info])
+            if event=='end' and not inside:
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+    except SyntaxError:
         return None
-    voms_servers  = xmldoc.getElementsByTagName('VOMS_Server')
 
+    return lscs
+
+def fetch_lsc_info(vo,session=requests,cache=None):
+    """Like get_lsc_info, but raises LSCError instead of exiting.
+    session can be a requests.Session to reuse its connections, cache a
+    Cache to avoid fetching VO ID cards that did not change."""
+
+    if cache is not None:
+        return cache.get('vo-'+vo,url+vo,session,lambda r: parse_card(r.content))
+
+    r=http_get(session,url+vo)
+
+    if r.status_code!=HTTPOK:
+        raise LSCError('Unable to get information for VO: '+vo)
+
+    return parse_card(r.content)
+
+def parse_index(source):
+    """Build {vo: {lsc_file_name: {'DN':..., 'CA_DN':...}}} from an XML
+    export of VO ID cards, read incrementally from the file object source.
+    Every ID card is removed from the tree once it has been read, so memory
+    use does not grow with the size of the export."""
+
+    index={}
+    vo=None
     lscs={}
-    for voms_server in voms_servers:
+    # The open elements, to find the parent of an ID card wherever it is.
+    parents=[]
+    for event,elem in ElementTree.iterparse(source, events=('start','end')):
+        if event=='start':
+            parents.append(elem)
+            if elem.tag=='IDCard':
+                vo=elem.get('Name')
+                lscs={}
+            continue
+        parents.pop()
+        if elem.tag=='VOMS_Server':
+            info=voms_server_info(elem)
+            if info:
+                lscs.update([info])
+        elif elem.tag=='IDCard':
+            if vo:
+                index[vo]=lscs
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
 
-        hostname  = voms_server.getElementsByTagName('hostname')[0]
-        lsc_file_name= hostname.firstChild.nodeValue+'.lsc'
+    return index
 
-        X509  = voms_server.getElementsByTagName('X509Cert')[0]
-        DN=X509.getElementsByTagName('DN')[0].firstChild.nodeValue
-        CA_DN=X509.getElementsByTagName('CA_DN')[0].firstChild.nodeValue
+def parse_index_response(r):
+    r.raw.decode_content=True
+    try:
+        return parse_index(r.raw)
+    except SyntaxError:
+        e=sys.exc_info()[1]
+        raise LSCError('Unable to parse the VO ID cards: '+str(e))
+    finally:
+        r.close()
 
-        lscs.update({lsc_file_name: {'DN':DN, 'CA_DN':CA_DN} })
+def fetch_index(session=requests,cache=None):
+    """Download the ID cards of all VOs at once and return them as an index
+    for get_lsc_info. Raises LSCError."""
 
-    return lscs
+    if cache is not None:
+        return cache.get('all',all_url,session,parse_index_response,stream=True)
+
+    r=http_get(session,all_url,stream=True)
+
+    if r.status_code!=HTTPOK:
+        r.close()
+        raise LSCError('Unable to get the VO ID cards from '+all_url)
+
+    return parse_index_response(r)
+
+def file_hash(lsc_path):
+    """sha256 of an LSC file, ignoring leading and trailing whitespace."""
+    f=open(lsc_path,'r')
+    textlist=map(string.strip,f.readlines())
+    f.close()
+    return hashlib.sha256(''.join(textlist)).hexdigest()
+
+def portal_hash(info):
+    """sha256 of the LSC file that the portal expects, to compare with
+    file_hash. info is one of the values returned by get_lsc_info."""
+    textlist=[ info['DN'], info['CA_DN'] ]
+    return hashlib.sha256(''.join(textlist).encode('utf-8')).hexdigest()
+
+class State(object):
+    """Remembers for every LSC file its mtime, ctime, size and sha256, and
+    the hash of the portal's version it was last compared with, in a JSON
+    file. A file is only read again when it changed on disk, and only
+    compared again when it or the portal's version changed. The ctime is
+    kept because tools that copy files may preserve the mtime."""
+
+    def __init__(self,path=None):
+        self.path=path
+        self.seen=set()
+        self.rehashed=0
+        self.rechecked=0
+        self.files={}
+        if path is None:
+            # Only kept in memory, by a process that checks repeatedly.
+            return
+        try:
+            f=open(path,'r')
+            try:
+                self.files=json.load(f)['files']
+            finally:
+                f.close()
+        except (IOError,ValueError,KeyError):
+            self.files={}
+
+    def check(self,lsc_path,info):
+        """Whether the LSC file matches info, one of the values returned
+        by get_lsc_info."""
+        st=os.stat(lsc_path)
+        stamp=[st.st_mtime,st.st_ctime,st.st_size]
+        entry=self.files.get(lsc_path)
+        if entry is None or entry['stamp']!=stamp:
+            entry={'stamp':stamp,'sha256':file_hash(lsc_path)}
+            self.files[lsc_path]=entry
+            self.rehashed+=1
+        remote=portal_hash(info)
+        if entry.get('remote')!=remote:
+            entry['remote']=remote
+            entry['match']=entry['sha256']==remote
+            self.rechecked+=1
+        self.seen.add(lsc_path)
+        return entry['match']
+
+    def save(self):
+        """Write the state of the files that were checked in this run."""
+        if self.path is None:
+            return
+        directory=os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        files=dict((path,entry) for (path,entry) in self.files.items() if path in self.seen)
+        write_json(self.path,{'files':files})
+
+def compare(vomsdir,vo,lscs,state=None):
+    """Compare the LSC files of a VO in vomsdir with lscs, the result of
+    get_lsc_info. Yields (status, lsc_file_name, lsc_path) for every VOMS
+    server of the VO, in order, with status 'ok', 'discrepancy' or
+    'missing'. With a State, unchanged files are not read again."""
+
+    for voms_server in sorted(lscs or {}):
+        lsc_path=vomsdir+'/'+vo+'/'+voms_server.encode('ascii')
+        if not os.path.isfile(lsc_path):
+            yield ('missing',voms_server,lsc_path)
+            continue
+        if state is not None:
+            match=state.check(lsc_path,lscs[voms_server])
+        else:
+            match=file_hash(lsc_path)==portal_hash(lscs[voms_server])
+        yield ('ok' if match else 'discrepancy',voms_server,lsc_path)
+
+def get_lsc_info(vo,session=requests,index=None):
+    """Return {lsc_file_name: {'DN':..., 'CA_DN':...}} for a VO. With an
+    index from fetch_index, the VO is looked up there instead of in the
+    portal; VOs that are not in the index give None."""
+
+    if index is not None:
+        return index.get(vo)
+
+    try:
+        return fetch_lsc_info(vo,session)
+    except LSCError:
+        e=sys.exc_info()[1]
+        sys.stderr.write(str(e)+'\n')
+        sys.exit(1)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# Keeps checking the LSC files and serves the results as Prometheus
+# metrics, so that a broken LSC file can be alerted on within minutes
+# instead of waiting for someone to run check_lsc.py or check_lsc.
+#
+# Support:
+#    Contact <helpdesk@surfsara.nl>
+
+import lsc
+import vomsserver
+import os,sys,time,random,threading
+import argparse
+import textwrap
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+try:
+    from BaseHTTPServer import HTTPServer,BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer,BaseHTTPRequestHandler
+
+vomsdir=lsc.vomsdir
+
+parser=argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=textwrap.dedent('''\
+
+        Checks the LSC files in '''+vomsdir+''' against the VO ID cards in
+        the operations portal (like check_lsc.py) every --interval seconds,
+        and optionally against the VOMS servers (like check_lsc), and
+        serves the results on http://[listen]/metrics in the Prometheus
+        text format.
+
+        Usage:
+        $ python lsc_monitor.py --listen 127.0.0.1:9478 --voms
+
+        Metrics:
+        lsc_mismatches                 LSC files that differ from the portal
+        lsc_missing_files              LSC files in the portal but not here
+        lsc_voms_mismatches            LSC files that differ from the VOMS server
+        lsc_voms_unreachable_servers   VOMS servers that did not answer or
+                                       failed the TLS handshake
+        lsc_file_mismatch{vo,file,source} / lsc_file_missing{vo,file}
+                                       1 for every file with a problem
+        lsc_voms_server_up{server}     0 or 1 per VOMS server
+        lsc_voms_check_seconds{server} slowest check against a VOMS server
+        lsc_check_duration_seconds, lsc_last_check_timestamp_seconds,
+        lsc_check_success              about the last round of checks
+        '''))
+parser.add_argument('--listen', action='store', dest='listen', default='127.0.0.1:9478',
+    help='Address and port to serve the metrics on. Default: 127.0.0.1:9478.')
+parser.add_argument('--interval', action='store', dest='interval', type=int, default=300,
+    help='Seconds between the starts of two rounds of checks. Default: 300.')
+parser.add_argument('--jitter', action='store', dest='jitter', type=float, default=0.1,
+    help='Vary the interval randomly by this fraction, so that monitors on many hosts '
+         'do not hit the portal and the VOMS servers at the same time. Default: 0.1.')
+parser.add_argument('--workers', action='store', dest='workers', type=int, default=8,
+    help='Number of VO ID cards to fetch in parallel. Default: 8.')
+parser.add_argument('--cache-dir', action='store', dest='cache_dir', default=lsc.cache_dir,
+    help='Directory to cache the VO ID cards in. Default: '+lsc.cache_dir)
+parser.add_argument('--ttl', action='store', dest='ttl', type=int, default=300,
+    help='Seconds to use cached VO ID cards without asking the portal whether they changed. Default: 300.')
+parser.add_argument('--voms', action='store_true', dest='voms', default=False,
+    help='Also check the LSC files against the VOMS servers.')
+parser.add_argument('--voms-workers', action='store', dest='voms_workers', type=int, default=16,
+    help='Number of LSC files to check against the VOMS servers in parallel. Default: 16.')
+args=parser.parse_args()
+
+if args.interval<1 or args.workers<1 or args.voms_workers<1:
+    parser.error('--interval, --workers and --voms-workers must be at least 1')
+if not 0<=args.jitter<1:
+    parser.error('--jitter must be at least 0 and less than 1')
+(address,_,port)=args.listen.rpartition(':')
+try:
+    port=int(port)
+except ValueError:
+    parser.error('--listen must be [address]:port')
+
+help_texts={
+    'lsc_mismatches':'Number of LSC files that do not match the VO ID card in the operations portal.',
+    'lsc_missing_files':'Number of LSC files that are in the operations portal but not in the vomsdir.',
+    'lsc_voms_mismatches':'Number of LSC files that do not match the certificate of the VOMS server.',
+    'lsc_voms_unreachable_servers':'Number of VOMS servers that could not be contacted or failed the TLS handshake.',
+    'lsc_file_mismatch':'LSC file that does not match the portal or the VOMS server.',
+    'lsc_file_missing':'LSC file that is in the operations portal but not in the vomsdir.',
+    'lsc_voms_server_up':'Whether the VOMS server could be contacted.',
+    'lsc_voms_check_seconds':'Seconds taken by the slowest check of an LSC file against the VOMS server.',
+    'lsc_check_duration_seconds':'Seconds taken by the last round of checks.',
+    'lsc_last_check_timestamp_seconds':'Time at which the last round of checks finished.',
+    'lsc_check_success':'Whether the last round of checks could get all VO ID cards.',
+}
+
+def label_value(value):
+    return value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+def render(samples):
+    """Prometheus text format for samples, a list of (name, labels, value)
+    with labels a list of (label, value)."""
+    lines=[]
+    names=[]
+    by_name={}
+    for (name,labels,value) in samples:
+        if name not in by_name:
+            names.append(name)
+            by_name[name]=[]
+        by_name[name].append((labels,value))
+    for name in names:
+        lines.append('# HELP %s %s' % (name,help_texts[name]))
+        lines.append('# TYPE %s gauge' % name)
+        for (labels,value) in by_name[name]:
+            if labels:
+                text=','.join('%s="%s"' % (label,label_value(v)) for (label,v) in labels)
+                lines.append('%s{%s} %s' % (name,text,repr(float(value))))
+            else:
+                lines.append('%s %s' % (name,repr(float(value))))
+    return '\n'.join(lines)+'\n'
+
+class Metrics(object):
+    """The metrics of the last round of checks, replaced as a whole."""
+
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.text=''
+
+    def set(self,text):
+        with self.lock:
+            self.text=text
+
+    def get(self):
+        with self.lock:
+            return self.text
+
+metrics=Metrics()
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0]!='/metrics':
+            self.send_error(404)
+            return
+        body=metrics.get().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        # Don't write a line to stderr for every scrape.
+        pass
+
+session=lsc.new_session(args.workers)
+try:
+    cache=lsc.Cache(args.cache_dir,args.ttl)
+except OSError:
+    e=sys.exc_info()[1]
+    sys.stderr.write('Not using the cache: '+str(e)+'\n')
+    cache=None
+# Kept across rounds, so that LSC files are only read again when they change.
+state=lsc.State()
+if args.voms:
+    vomsserver.check_capath()
+cert=vomsserver.client_certificate() if args.voms else None
+pool=ThreadPool(args.workers)
+voms_pool=ThreadPool(args.voms_workers) if args.voms else None
+
+def fetch(vo):
+    try:
+        return (vo, lsc.fetch_lsc_info(vo,session,cache), None)
+    except lsc.LSCError:
+        return (vo, None, sys.exc_info()[1])
+
+def timed_check(checker,vo,lsc_path):
+    start=time.time()
+    result=checker.check(vo,lsc_path)
+    return (result,time.time()-start)
+
+def check():
+    """One round of checks. Returns the samples for render."""
+    start=time.time()
+    vos=sorted(vo for vo in os.listdir(vomsdir) if os.path.isdir(os.path.join(vomsdir,vo)))
+
+    # The VOMS servers are checked in the background meanwhile; they are
+    # asked again every round, so a fresh Checker forgets the last answers.
+    voms_results=[]
+    if args.voms:
+        checker=vomsserver.Checker(cert,args.voms_workers)
+        for vo in vos:
+            d=os.path.join(vomsdir,vo)
+            for name in sorted(os.listdir(d)):
+                if name.endswith('.lsc'):
+                    lsc_path=os.path.join(d,name)
+                    voms_results.append((vo,name,voms_pool.apply_async(timed_check,(checker,vo,lsc_path))))
+
+    success=1
+    files=[]
+    for vo,r,error in pool.imap(fetch,vos):
+        if error:
+            sys.stderr.write(str(error)+'\n')
+            success=0
+            continue
+        for status,voms_server,lsc_path in lsc.compare(vomsdir,vo,r,state):
+            if status!='ok':
+                files.append((status,vo,voms_server))
+
+    voms_mismatches=[]
+    servers={}
+    deadline=start+args.interval
+    for (vo,name,result) in voms_results:
+        server=name[:-len('.lsc')]
+        try:
+            ((status,message,details),seconds)=result.get(max(0,deadline-time.time()))
+        except TimeoutError:
+            (status,seconds)=('error',args.interval)
+        if status=='mismatch':
+            voms_mismatches.append((vo,name))
+        servers[server]=max(servers.get(server,0),seconds)
+    unreachable=[server for server in servers if server in checker.dead] if args.voms else []
+
+    samples=[('lsc_mismatches',[],len([f for f in files if f[0]=='discrepancy'])),
+             ('lsc_missing_files',[],len([f for f in files if f[0]=='missing']))]
+    if args.voms:
+        samples.append(('lsc_voms_mismatches',[],len(voms_mismatches)))
+        samples.append(('lsc_voms_unreachable_servers',[],len(unreachable)))
+    for (status,vo,name) in files:
+        if status=='discrepancy':
+            samples.append(('lsc_file_mismatch',[('vo',vo),('file',name),('source','portal')],1))
+    for (vo,name) in voms_mismatches:
+        samples.append(('lsc_file_mismatch',[('vo',vo),('file',name),('source','voms')],1))
+    for (status,vo,name) in files:
+        if status=='missing':
+            samples.append(('lsc_file_missing',[('vo',vo),('file',name)],1))
+    for server in sorted(servers):
+        samples.append(('lsc_voms_server_up',[('server',server)],0 if server in unreachable else 1))
+    for server in sorted(servers):
+        samples.append(('lsc_voms_check_seconds',[('server',server)],servers[server]))
+    now=time.time()
+    samples.append(('lsc_check_duration_seconds',[],now-start))
+    samples.append(('lsc_last_check_timestamp_seconds',[],now))
+    samples.append(('lsc_check_success',[],success))
+    return samples
+
+server=HTTPServer((address,port),Handler)
+thread=threading.Thread(target=server.serve_forever)
+thread.daemon=True
+thread.start()
+
+while True:
+    start=time.time()
+    try:
+        metrics.set(render(check()))
+    except Exception:
+        # Keep serving the metrics of the last round that worked; they
+        # show their age in lsc_last_check_timestamp_seconds.
+        e=sys.exc_info()[1]
+        sys.stderr.write('Check failed: %s\n' % e)
+    interval=args.interval*random.uniform(1-args.jitter,1+args.jitter)
+    time.sleep(max(0,start+interval-time.time()))
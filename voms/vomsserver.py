@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Checks whether local LSC files and the certificates of the VOMS servers
+# match, by asking the VOMS servers themselves (check_lsc.py compares with
+# the operations portal instead). This is the engine behind check_lsc: the
+# configuration pages and certificates of all VOMS servers are fetched in
+# parallel, each endpoint only once, and a dead server can't stall the run
+# for longer than the timeouts.
+
+import os,sys,glob,socket,ssl,subprocess,threading,time,re,json
+import argparse
+import requests
+from requests.packages.urllib3.exceptions import HTTPError as urllib3_error
+import lsc
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+vomsdir=os.path.join(lsc.vomsdir,'')
+capath=os.environ.get('X509_CERT_DIR','/etc/grid-security/certificates/')
+hostcert='/etc/grid-security/hostcert.pem'
+hostkey='/etc/grid-security/hostkey.pem'
+voms_port=os.environ.get('VOMS_PORT','8443')
+config_url='https://%(server)s:%(port)s/voms/%(vo)s/configuration/configuration.action'
+connect_timeout=10
+read_timeout=30
+certificate_cache=os.path.join(lsc.cache_dir,'certificates.json')
+
+# Eye candy. Not all editors may show them properly.
+icon_checkmark='✅'
+icon_redcross='❌'
+icon_question='❓'
+
+class VOMSError(Exception):
+    pass
+
+class HandshakeError(VOMSError):
+    """A VOMS server could not be reached, or its TLS handshake failed."""
+    pass
+
+# Short names used by 'openssl -nameopt compat' for the attributes that
+# other tools report by their long names.
+short_names={
+    'countryName':'C',
+    'stateOrProvinceName':'ST',
+    'localityName':'L',
+    'organizationName':'O',
+    'organizationalUnitName':'OU',
+    'commonName':'CN',
+    'domainComponent':'DC',
+    'userId':'UID',
+    'streetAddress':'street',
+    'surname':'SN',
+    'givenName':'GN',
+}
+
+compat_split=re.compile(r'/(?=[A-Za-z][A-Za-z0-9.]*=)')
+rfc2253_split=re.compile(r'(?<!\\)[,+]')
+
+def normalise_dn(dn):
+    """Turn a DN in compat (/C=NL/O=Example/CN=host), RFC 2253
+    (CN=host,O=Example,C=NL) or 'openssl -nameopt oneline'
+    (C = NL, O = Example, CN = host) format into a tuple of
+    (attribute, value) pairs, most significant first, so that the same DN
+    compares equal in each format."""
+    dn=dn.strip()
+    if dn.startswith('/'):
+        parts=compat_split.split(dn[1:])
+        reverse=False
+    elif ' = ' in dn:
+        parts=[part.strip() for part in dn.split(', ')]
+        reverse=False
+    elif '=' in dn:
+        parts=rfc2253_split.split(dn)
+        reverse=True
+    else:
+        return (dn,)
+    pairs=[]
+    for part in parts:
+        (attribute,_,value)=part.partition('=')
+        attribute=attribute.strip()
+        attribute=short_names.get(attribute,attribute)
+        if attribute.upper() in ('C','ST','L','O','OU','CN','DC','UID','SN','GN'):
+            attribute=attribute.upper()
+        pairs.append((attribute,value.strip().replace('\\,',',').replace('\\+','+')))
+    if reverse:
+        pairs.reverse()
+    return tuple(pairs)
+
+def decode_certificate(der):
+    """Return the subject and issuer of a DER encoded certificate, as
+    'openssl x509 -nameopt compat' shows them."""
+    pem=ssl.DER_cert_to_PEM_cert(der)
+    # Older versions of openssl don't support -nameopt compat and they
+    # choke on it; their default format is the same.
+    for nameopt in (['-nameopt','compat'],[]):
+        p=subprocess.Popen(['openssl','x509','-noout','-subject','-issuer']+nameopt,
+                           stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        (out,err)=p.communicate(pem.encode('ascii'))
+        if p.returncode==0:
+            break
+    else:
+        raise VOMSError('openssl could not decode the certificate: %s' % err.decode('utf-8','replace').strip())
+    names={}
+    for line in out.decode('utf-8','replace').splitlines():
+        (name,_,dn)=line.partition('=')
+        names[name.strip()]=dn.strip()
+    return (names.get('subject'),names.get('issuer'))
+
+def peer_certificate(host,port):
+    """Do a TLS handshake with host:port and return the subject and issuer
+    of its certificate."""
+    context=ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.verify_mode=ssl.CERT_NONE
+    try:
+        sock=socket.create_connection((host,int(port)),timeout=connect_timeout)
+        try:
+            tls=context.wrap_socket(sock,server_hostname=host)
+            der=tls.getpeercert(True)
+            tls.close()
+        finally:
+            sock.close()
+    except (socket.error,ssl.SSLError):
+        e=sys.exc_info()[1]
+        raise HandshakeError(str(e))
+    except ValueError:
+        e=sys.exc_info()[1]
+        raise VOMSError(str(e))
+    if not der:
+        raise VOMSError('no certificate')
+    return decode_certificate(der)
+
+def parse_interface(page):
+    """Get host:port of the VOMS interface from the VOMSES line on the
+    configuration page of a VO."""
+    lines=page.splitlines()
+    for (n,line) in enumerate(lines):
+        if 'VOMSES' not in line:
+            continue
+        for line in lines[n:n+11]:
+            if 'configurationInfo' in line:
+                text=line
+                while '<' in text and '>' in text[text.index('<'):]:
+                    start=text.index('<')
+                    text=text[:start]+text[text.index('>',start)+1:]
+                fields=text.replace('&quot;','').split()
+                if len(fields)>=3:
+                    return '%s:%s' % (fields[1],fields[2])
+        return None
+    return None
+
+class Once(object):
+    """Runs a function once per key, also when several threads ask for the
+    same key at the same time: the others wait for the first one and get
+    its result (or its exception)."""
+
+    def __init__(self,func):
+        self.func=func
+        self.lock=threading.Lock()
+        self.results={}
+
+    def __call__(self,*key):
+        with self.lock:
+            if key not in self.results:
+                self.results[key]=(threading.Event(),[])
+                mine=True
+            else:
+                mine=False
+            (done,result)=self.results[key]
+        if mine:
+            try:
+                result.append((True,self.func(*key)))
+            except Exception:
+                result.append((False,sys.exc_info()[1]))
+            done.set()
+        done.wait()
+        (ok,value)=result[0]
+        if not ok:
+            raise value
+        return value
+
+def client_certificate(debug=False):
+    """VOMS servers need client certificate authentication.
+    If we are root, we can use the local host certificate as a client certificate.
+    If we are a normal user, we look for a X509 proxy.
+    X509_USER_CERT and X509_USER_KEY override both."""
+    if os.environ.get('X509_USER_CERT') and os.environ.get('X509_USER_KEY'):
+        if debug:
+            print('Using %s as client certificate.' % os.environ['X509_USER_CERT'])
+        return (os.environ['X509_USER_CERT'],os.environ['X509_USER_KEY'])
+    if os.geteuid()==0:
+        if debug:
+            print('You are root. Using local host certificate as client certificate.')
+        return (hostcert,hostkey)
+    if debug:
+        print('You are a regular user. Using X509 VOMS proxy as client certificate.')
+    proxy=os.environ.get('X509_USER_PROXY','/tmp/x509up_u%d' % os.getuid())
+    if subprocess.call(['voms-proxy-info','-exists','-valid','0:10'])!=0:
+        print('%s VOMS proxy has (almost) expired or is not present.' % icon_redcross)
+        subprocess.call(['voms-proxy-info','-all'])
+        sys.exit(1)
+    if debug:
+        print('VOMS proxy is still valid.')
+    return proxy
+
+def check_capath():
+    """Exit when the CA directory that the VOMS servers are verified with
+    does not exist; requests would fail every check on it."""
+    if not os.path.isdir(capath):
+        print('%s CA directory %s does not exist. Set X509_CERT_DIR.' % (icon_redcross,capath))
+        sys.exit(1)
+
+class CertificateCache(object):
+    """Short-lived cache of the subject and issuer per VOMS endpoint
+    (host:port) across runs, in a JSON file. Entries older than ttl
+    seconds are ignored."""
+
+    def __init__(self,path=certificate_cache,ttl=600):
+        self.path=path
+        self.ttl=ttl
+        self.lock=threading.Lock()
+        try:
+            f=open(path,'r')
+            try:
+                self.entries=json.load(f)
+            finally:
+                f.close()
+        except (IOError,ValueError):
+            self.entries={}
+
+    def get(self,interface):
+        entry=self.entries.get(interface)
+        if entry and time.time()-entry['fetched']<self.ttl:
+            return (entry['subject'],entry['issuer'])
+        return None
+
+    def put(self,interface,certificate):
+        with self.lock:
+            self.entries[interface]={'fetched':time.time(),
+                                     'subject':certificate[0],
+                                     'issuer':certificate[1]}
+
+    def save(self):
+        now=time.time()
+        with self.lock:
+            entries=dict((interface,entry) for (interface,entry) in self.entries.items()
+                         if now-entry['fetched']<self.ttl)
+        directory=os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp='%s.%d.tmp' % (self.path,os.getpid())
+        f=open(tmp,'w')
+        json.dump(entries,f)
+        f.close()
+        os.rename(tmp,self.path)
+
+class Checker(object):
+    """Checks LSC files against the VOMS servers. Configuration pages are
+    fetched once per (server, VO) and certificates once per endpoint. When
+    a server does not answer, the other checks on that server fail right
+    away instead of waiting for their own timeouts."""
+
+    def __init__(self,cert,workers=16,debug=False,cache=None):
+        self.debug=debug
+        self.cache=cache
+        self.session=requests.Session()
+        self.session.cert=cert
+        adapter=requests.adapters.HTTPAdapter(pool_connections=workers,pool_maxsize=workers)
+        self.session.mount('https://',adapter)
+        self.dead=set()
+        self.configuration=Once(self.fetch_configuration)
+        self.certificate=Once(self.fetch_certificate)
+
+    def fetch_configuration(self,server,vo):
+        url=config_url % {'server':server,'port':voms_port,'vo':vo}
+        if server in self.dead:
+            raise VOMSError('Could not read from %s  - %s could not be reached earlier in this run' % (url,server))
+        if self.debug:
+            sys.stderr.write('GET %s\n' % url)
+        try:
+            # verify per request: a session's verify loses from REQUESTS_CA_BUNDLE.
+            r=self.session.get(url,verify=capath,timeout=(connect_timeout,read_timeout))
+            r.raise_for_status()
+        except (requests.exceptions.ConnectionError,requests.exceptions.SSLError,requests.exceptions.Timeout):
+            # A failed TLS handshake or certificate check makes a server as
+            # unreachable as one that does not answer.
+            e=sys.exc_info()[1]
+            self.dead.add(server)
+            raise VOMSError('Could not read from %s  - %s' % (url,e))
+        except (requests.exceptions.RequestException,urllib3_error,ssl.SSLError,EnvironmentError):
+            # Not only RequestException: urllib3 lets some TLS errors
+            # through while the body is read, e.g. when the server hangs up
+            # without closing the TLS session properly, and requests raises
+            # a plain IOError when the CA directory can't be read.
+            e=sys.exc_info()[1]
+            raise VOMSError('Could not read from %s  - %s' % (url,e))
+        return r.text
+
+    def fetch_certificate(self,interface):
+        if self.cache:
+            certificate=self.cache.get(interface)
+            if certificate:
+                return certificate
+        (host,_,port)=interface.rpartition(':')
+        if self.debug:
+            sys.stderr.write('TLS handshake with %s\n' % interface)
+        certificate=peer_certificate(host,port)
+        if self.cache:
+            self.cache.put(interface,certificate)
+        return certificate
+
+    def check(self,vo,lscfile):
+        """Return (status, message, details) for one LSC file. status is
+        'ok', 'mismatch', 'error' or 'warning'."""
+        f=open(lscfile,'r')
+        lsc_file_info=[line.rstrip('\n') for line in f if line.rstrip('\n') and not line.startswith('#')]
+        f.close()
+        # The LSC file should be at least two lines.
+        # An empty LSC file can break dCache! We want to see this!
+        if not lsc_file_info:
+            return ('warning','%s WARNING: file %s seems to be empty.' % (icon_question,lscfile),None)
+
+        server=os.path.basename(lscfile)[:-len('.lsc')]
+        try:
+            page=self.configuration(server,vo)
+        except VOMSError:
+            return ('error','%s %s' % (icon_question,sys.exc_info()[1]),None)
+        interface=parse_interface(page)
+        if not interface:
+            return ('error','%s Could not get LSC info from VOMS server at %s.' % (icon_question,server),None)
+        try:
+            lsc_live_info=list(self.certificate(interface))
+        except HandshakeError:
+            self.dead.add(server)
+            return ('error','%s Could not get LSC info from VOMS server at %s.' % (icon_question,interface),None)
+        except VOMSError:
+            return ('error','%s Could not get LSC info from VOMS server at %s.' % (icon_question,interface),None)
+
+        # The LSC file may have the DNs in another format than we get them in.
+        if [normalise_dn(dn) for dn in lsc_live_info]!=[normalise_dn(dn) for dn in lsc_file_info]:
+            details=['== %s ==' % lscfile]+lsc_file_info+['== %s ==' % interface]+lsc_live_info
+            return ('mismatch','%s LSC info does not match.' % icon_redcross,details)
+        return ('ok','%s OK' % icon_checkmark,None)
+
+def parse_args():
+    parser=argparse.ArgumentParser(
+        usage='%(prog)s [VO] [--errors|--verbose] [--debug]',
+        description='Checks whether local LSC files and VOMS server info match.')
+    parser.add_argument('vo',metavar='VO',nargs='?',
+        help='Check only this Virtual Organisation. Default: check LSC files of all VOs.')
+    parser.add_argument('--errors',action='store_true',default=False,
+        help='Show all errors (LSC mismatches and VOMS server errors). Default: show only LSC mismatches')
+    parser.add_argument('--verbose',action='store_true',default=False,
+        help='Show everything: errors and successes. Default: show only LSC mismatches')
+    parser.add_argument('--debug',action='store_true',default=False,
+        help='Show HTTPS operations')
+    parser.add_argument('--workers',action='store',type=int,default=16,
+        help='Number of LSC files to check in parallel. Default: 16.')
+    parser.add_argument('--timeout',action='store',type=int,default=300,
+        help='Maximum number of seconds for the whole run. Default: 300.')
+    parser.add_argument('--cert-ttl',action='store',dest='cert_ttl',type=int,default=0,
+        help='Reuse VOMS server certificates from earlier runs for this many seconds. Default: 0 (no reuse).')
+    parser.add_argument('--cert-cache',action='store',dest='cert_cache',default=certificate_cache,
+        help='File to keep the VOMS server certificates in for --cert-ttl. Default: '+certificate_cache)
+    args=parser.parse_args()
+    if args.debug:
+        args.verbose=True
+    if args.verbose:
+        args.errors=True
+    return args
+
+def main():
+    args=parse_args()
+    deadline=time.time()+args.timeout
+
+    if args.vo:
+        dirs=[os.path.join(vomsdir,args.vo)]
+    else:
+        dirs=sorted(glob.glob(os.path.join(vomsdir,'*')))
+
+    check_capath()
+    cache=CertificateCache(args.cert_cache,args.cert_ttl) if args.cert_ttl>0 else None
+    checker=Checker(client_certificate(args.debug),args.workers,args.debug,cache)
+    pool=ThreadPool(args.workers)
+
+    # Start all checks, then report them in the order of the VOs and files.
+    tasks=[]
+    for d in dirs:
+        vo=os.path.basename(d)
+        lscfiles=sorted(glob.glob(os.path.join(d,'*.lsc')))
+        results=[(lscfile,pool.apply_async(checker.check,(vo,lscfile))) for lscfile in lscfiles]
+        tasks.append((d,vo,results))
+
+    for (d,vo,results) in tasks:
+        if args.verbose:
+            print('')
+        if not results:
+            if args.verbose:
+                print('%s Dir %s does not contain any LSC files. It can probably be removed.' % (icon_redcross,d))
+            continue
+        for (lscfile,result) in results:
+            prefix='=== %s/%s =>' % (vo,os.path.basename(lscfile))
+            try:
+                (status,message,details)=result.get(max(0,deadline-time.time()))
+            except TimeoutError:
+                (status,message,details)=('error','%s Could not check %s: did not finish within %d seconds' % (icon_question,lscfile,args.timeout),None)
+            if status=='mismatch':
+                print('%s %s' % (prefix,message))
+                for line in details:
+                    print(('    ' if line.startswith('/') else '  ')+line)
+            elif status in ('error','warning'):
+                if args.errors:
+                    print('%s %s' % (prefix,message))
+            elif args.verbose:
+                print('%s %s' % (prefix,message))
+            sys.stdout.flush()
+
+    if cache:
+        cache.save()
+
+if __name__ == '__main__':
+    main()